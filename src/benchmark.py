@@ -0,0 +1,261 @@
+#!/usr/bin/env python3.9
+"""
+Benchmarks projecting and painting the overlay's scene without the game or
+a display. Synthetic scenes of markers and trails are rendered into a QImage
+on Qt's offscreen platform, along a synthetic camera path or one taken from
+a link recording, and the frame rate, frame time percentiles and peak memory
+of each scene size are reported.
+
+Results can be saved as JSON with --output and compared against a previous
+run with --compare.
+"""
+import os
+# Render without a display unless told otherwise
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak memory isn't reported
+    resource = None
+
+from PyQt5 import QtGui, QtCore
+from PyQt5.QtWidgets import QApplication
+
+from geometry import Vector2, Vector3
+from frame_stats import FrameStats, PERCENTILES
+from icon_atlas import IconAtlas
+from link_recorder import LinkReplay
+from mumble_link import MumbleLink
+from overlay import Camera, paint_overlay
+from scene import Scene, AtlasIconNode, TrailNode
+
+
+# Number of markers, and of trail vertices, in each synthetic scene
+SCENE_SIZES = (10, 1000, 10000, 100000)
+BENCHMARK_FRAMES = 200
+SCREEN_SIZE = (1920, 1080)
+# Markers are spread over a box this many world units either side of the
+# center of the camera path, and this many up and down
+SCENE_RADIUS = 200.0
+SCENE_HEIGHT = 20.0
+# Distinct icons drawn by the markers
+ICON_COUNT = 64
+# Map id the markers are indexed under, see Node.index_points()
+BENCHMARK_MAP_ID = 0
+# Synthetic camera path: a circle around the scene's center
+ORBIT_RADIUS = 60.0
+ORBIT_HEIGHT = 15.0
+FOV = 1.0
+
+# (camera position, camera front, field of view) for each frame
+CameraPath = List[Tuple[np.ndarray, np.ndarray, float]]
+
+
+def synthetic_path(center: np.ndarray, frames: int) -> CameraPath:
+    """
+    @return A full circle around center, looking slightly down towards it
+    """
+    path = []
+    for angle in np.linspace(0, 2 * np.pi, frames, endpoint=False).tolist():
+        position = center + np.array([np.cos(angle) * ORBIT_RADIUS, ORBIT_HEIGHT, np.sin(angle) * ORBIT_RADIUS])
+        front = center - position
+        path.append((position, front / np.linalg.norm(front), FOV))
+    return path
+
+
+def recorded_path(path: str, frames: int) -> CameraPath:
+    """
+    @return The camera of each frame of a link recording, up to frames
+    """
+    link = MumbleLink(LinkReplay(path, realtime=False))
+    cameras = []
+    while len(cameras) < frames and link.update():
+        front = np.array(link.camera_front, dtype=float)
+        if np.linalg.norm(front) == 0:
+            continue
+        cameras.append((np.array(link.camera_position, dtype=float), front, link.identity.fov or FOV))
+    link.close()
+    return cameras
+
+
+def write_icons(directory: str) -> List[str]:
+    """
+    @return Paths of ICON_COUNT differently colored icons written to directory
+    """
+    paths = []
+    for index in range(ICON_COUNT):
+        image = QtGui.QImage(64, 64, QtGui.QImage.Format_ARGB32_Premultiplied)
+        image.fill(QtCore.Qt.transparent)
+        painter = QtGui.QPainter(image)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.setBrush(QtGui.QColor.fromHsv(index * 360 // ICON_COUNT, 200, 255))
+        painter.drawEllipse(4, 4, 56, 56)
+        painter.end()
+        path = os.path.join(directory, "{}.png".format(index))
+        image.save(path)
+        paths.append(path)
+    return paths
+
+
+def build_scene(size: int, center: np.ndarray, icons: List[str], rng: np.random.Generator,
+                cull: bool = True) -> Tuple[Scene, IconAtlas]:
+    """
+    @return A scene of size markers with random icons and a trail of size
+    vertices wandering from center, styled like the overlay's
+    @param cull index the markers in a SpatialGrid, like a map's markers
+    """
+    style = dict(pen=QtGui.QPen(QtCore.Qt.black), opacity=0.7)
+    extent = np.array([SCENE_RADIUS, SCENE_HEIGHT, SCENE_RADIUS])
+    markers = rng.uniform(center - extent, center + extent, (size, 3))
+    trail = center + np.cumsum(rng.normal(0, 1, (size, 3)) * (1, 0.1, 1), axis=0)
+
+    atlas = IconAtlas()
+    scene = Scene()
+    scene.add(AtlasIconNode(
+        markers, [icons[index] for index in rng.integers(0, len(icons), size)], atlas,
+        map_id=BENCHMARK_MAP_ID if cull else None, **style
+    ))
+    scene.add(TrailNode(trail, max_points=size, **style))
+    return scene, atlas
+
+
+def peak_memory() -> Optional[float]:
+    """
+    @return Peak resident memory of the process so far in MiB, or None if
+    it can't be measured here
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run(size: int, cameras: CameraPath, icons: List[str], seed: int = 0, cull: bool = True) -> Dict:
+    """
+    Renders every frame of cameras with a scene of size markers
+    @return Frame rate, frame time percentiles in milliseconds, per stage
+    times and memory use
+    """
+    center = np.mean([position for position, _, _ in cameras], axis=0)
+    scene, atlas = build_scene(size, center, icons, np.random.default_rng(seed), cull)
+    stats = FrameStats()
+    scene.stats = stats
+    screen_shape = Vector2(np.array(SCREEN_SIZE, dtype=int))
+    image = QtGui.QImage(*SCREEN_SIZE, QtGui.QImage.Format_ARGB32_Premultiplied)
+    Camera.clear_cache()
+
+    frame_times = []
+    for position, front, fov in cameras:
+        start = time.perf_counter()
+        with stats.stage("camera build"):
+            camera = Camera.cached(Vector3(position), Vector3(front), screen_shape, fov)
+        scene.update(camera)
+        image.fill(QtCore.Qt.transparent)
+        with stats.stage("paint"):
+            painter = QtGui.QPainter(image)
+            paint_overlay(painter, scene, image.rect())
+            painter.end()
+        frame_times.append(time.perf_counter() - start)
+
+    # The first frame also loads every icon, so it is reported on its own
+    first_frame, frame_times = frame_times[0] * 1000, np.array(frame_times[1:] or frame_times) * 1000
+    result = dict(
+        markers=size,
+        trail_vertices=size,
+        frames=len(cameras),
+        fps=1000 / float(frame_times.mean()),
+        first_frame=first_frame,
+        mean=float(frame_times.mean()),
+    )
+    for percentile, value in zip(PERCENTILES, np.percentile(frame_times, PERCENTILES).tolist()):
+        result["p{}".format(percentile)] = value
+    result["max"] = float(frame_times.max())
+    result["stages"] = stats.summary()
+    result["atlas_memory"] = atlas.memory_used / (1024 * 1024)
+    result["peak_memory"] = peak_memory()
+    return result
+
+
+def describe(result: Dict) -> str:
+    peak = result["peak_memory"]
+    return "{:>7} markers {:8.1f} fps  p50 {:7.2f}  p95 {:7.2f}  p99 {:7.2f} ms  first {:7.1f} ms  peak {}".format(
+        result["markers"], result["fps"], result["p50"], result["p95"], result["p99"], result["first_frame"],
+        "{:.0f} MiB".format(peak) if peak is not None else "n/a"
+    )
+
+
+def compare(results: List[Dict], path: str) -> None:
+    """
+    Prints how each scene size did against the same size in a saved run
+    """
+    with open(path) as f:
+        baseline = {result["markers"]: result for result in json.load(f)["results"]}
+    print("Compared to", path)
+    for result in results:
+        before = baseline.get(result["markers"])
+        if before is None:
+            continue
+        print("{:>7} markers  fps {:8.1f} -> {:8.1f} ({:+.0%})  p95 {:7.2f} -> {:7.2f} ms ({:+.0%})".format(
+            result["markers"], before["fps"], result["fps"], result["fps"] / before["fps"] - 1,
+            before["p95"], result["p95"], result["p95"] / before["p95"] - 1
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rendering the overlay without a display")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SCENE_SIZES, metavar="N",
+                        help="numbers of markers and trail vertices to benchmark, smallest first")
+    parser.add_argument("--frames", type=int, default=BENCHMARK_FRAMES, help="frames to render per scene")
+    parser.add_argument("--replay", metavar="PATH", help="take the camera path from a link recording")
+    parser.add_argument("--no-cull", action="store_true", help="project every marker instead of culling with a grid")
+    parser.add_argument("--output", metavar="PATH", help="save the results as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="compare against results saved with --output")
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    if args.replay:
+        cameras = recorded_path(args.replay, args.frames)
+        if not cameras:
+            print("No camera frames in", args.replay)
+            return 1
+    else:
+        cameras = synthetic_path(np.zeros(3), args.frames)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        icons = write_icons(directory)
+        # Smallest first, since peak memory only ever grows
+        for size in sorted(args.sizes):
+            results.append(run(size, cameras, icons, cull=not args.no_cull))
+            print(describe(results[-1]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(dict(
+                time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                python=platform.python_version(),
+                qt=QtCore.QT_VERSION_STR,
+                platform=platform.platform(),
+                qpa_platform=app.platformName(),
+                screen=SCREEN_SIZE,
+                camera_path=args.replay or "synthetic",
+                culled=not args.no_cull,
+                results=results,
+            ), f, indent=4)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
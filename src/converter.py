@@ -1,9 +1,11 @@
 import mmap
 import time
+import socket
 import struct
 import subprocess
 import sys
 import os
+from collections import deque
 
 
 # Get functions from win32api
@@ -83,11 +85,112 @@ SCRIPT_PATH = "C:\\Program Files\\Flan\\converter.py"
 MUMBLE_LINK_SIZE = 5460
 PAGE_SIZE = 4096
 OUTFILE = "Z:\\tmp\\gw2_mumble_link"
-ACTIVE_SLEEP_TIME = 1/30 # 30 updates per second
-INACTIVE_SLEEP_TIME = 5 # 1 update every 5 seconds
-TICKS_PER_SECOND = 1/ACTIVE_SLEEP_TIME
-SECONDS_UNTIL_INACTIVE = 10
-TICKS_UNTIL_INACTIVE = round(TICKS_PER_SECOND * SECONDS_UNTIL_INACTIVE)
+# The output file starts with a header holding a sequence counter, which is
+# odd while a frame is being copied and even once it is complete. Readers
+# retry if it was odd or changed during their read (a seqlock). The header
+# also carries the scheduler's measured tick rate and jitter, and the time
+# the frame was published.
+HEADER_SIZE = 32
+SEQUENCE = struct.Struct("<I")
+FRAME_INFO = struct.Struct("<ffd")
+FRAME_INFO_OFFSET = 8
+OUTFILE_SIZE = HEADER_SIZE + PAGE_SIZE
+# A datagram carrying the new sequence number is sent here after each frame
+# so the overlay can wake up on new frames instead of polling
+NOTIFY_ADDRESS = ("127.0.0.1", 47320)
+ACTIVE_SLEEP_TIME = 1/30 # At most 30 updates per second
+INACTIVE_SLEEP_TIME = 5 # At least 1 update every 5 seconds
+WAKE_MARGIN = 0.002 # Wake this long after an update is expected
+PHASE_NUDGE = 0.0002 # Move the phase estimate this much earlier on every hit
+MIN_RETRY_TIME = 0.002 # Shortest wait after waking up too early
+BACKOFF_FACTOR = 1.5 # Growth of the wait for every consecutive miss
+SMOOTHING = 0.1 # Weight of each new sample in the jitter average
+RATE_WINDOW = 32 # Number of observed ticks the tick rate is measured over
+MAX_SAMPLE_GAP = 1 # Gaps longer than this (loading screens) restart measuring
+
+
+class TickScheduler:
+    """
+    Decides how long to sleep between reads of the mumble link. The game
+    updates ui_tick once per rendered frame, so the scheduler measures the
+    time per tick over the last RATE_WINDOW observed changes and keeps an
+    estimate of when the latest tick happened, then wakes up just after the
+    expected update closest to ACTIVE_SLEEP_TIME away.
+
+    Observing a new tick only proves it happened at some point before the
+    wake up, so the phase estimate creeps earlier on every hit and is pushed
+    back later whenever a wake up finds no new tick. When ticks stop arriving
+    (unfocused game, loading screens) the wait grows geometrically up to
+    INACTIVE_SLEEP_TIME.
+    """
+
+    def __init__(self):
+        self.tick_interval = ACTIVE_SLEEP_TIME
+        self.jitter = 0.0
+        self.misses = 0
+        self.previous_tick = None
+        self.change_time = None
+        self.miss_time = None
+        self.tick_time = None
+        self.history = deque(maxlen=RATE_WINDOW)
+
+    @property
+    def tick_rate(self) -> float:
+        """
+        @return Measured game ticks per second
+        """
+        return 1 / self.tick_interval
+
+    def observe(self, tick: int, now: float) -> bool:
+        """
+        @return True if the tick changed since the previous observation
+        """
+        if tick == 0 or tick == self.previous_tick:
+            if self.misses == 0 and self.tick_time is not None:
+                # The next tick has not happened yet, so the latest one
+                # was less than an interval ago
+                self.tick_time = max(self.tick_time, now - self.tick_interval)
+            self.misses += 1
+            self.miss_time = now
+            return False
+
+        if self.previous_tick is not None and tick > self.previous_tick and now - self.change_time < MAX_SAMPLE_GAP:
+            ticks = tick - self.previous_tick
+            sample = (now - self.change_time) / ticks
+            self.jitter += SMOOTHING * (abs(sample - self.tick_interval) - self.jitter)
+            # Measuring over many ticks keeps the estimate from following
+            # the scheduler's own wake up errors
+            self.history.append((tick, now))
+            first_tick, first_time = self.history[0]
+            if tick > first_tick:
+                self.tick_interval = (now - first_time) / (tick - first_tick)
+            # Whatever the prediction, the new tick happened before now, after
+            # any earlier miss, and less than an interval ago since the one
+            # after it has not happened yet
+            expected = self.tick_time + ticks * self.tick_interval
+            self.tick_time = max(min(now, expected) - PHASE_NUDGE, now - self.tick_interval)
+            if self.misses:
+                self.tick_time = max(self.tick_time, self.miss_time)
+        else:
+            self.history.clear()
+            self.history.append((tick, now))
+            self.tick_time = now
+
+        self.previous_tick = tick
+        self.change_time = now
+        self.misses = 0
+        return True
+
+    def sleep_time(self, now: float) -> float:
+        if self.misses:
+            retry_time = max(MIN_RETRY_TIME, self.jitter)
+            return min(INACTIVE_SLEEP_TIME, retry_time * BACKOFF_FACTOR ** (self.misses - 1))
+
+        # Skip game ticks to stay near the maximum rate, rounding so that a
+        # game running right at that rate is not read every other tick
+        ticks_ahead = max(1, round(ACTIVE_SLEEP_TIME / self.tick_interval))
+        wake_time = self.tick_time + ticks_ahead * self.tick_interval + WAKE_MARGIN + self.jitter
+        return min(INACTIVE_SLEEP_TIME, max(0, wake_time - now))
 
 
 def main():
@@ -114,39 +217,52 @@ def main():
 
     # Open shared memory
     print("Opening gw2 mumble link")
-    with mmap.mmap(fileno=-1, length=MUMBLE_LINK_SIZE, tagname="MumbleLink") as in_file:
-        with open(OUTFILE, "wb") as out_file:
-            # Run loop
-            previous_tick = None
-            missed_ticks = 0
-            while True:
-                # Seek both input and output to the beginning
-                in_file.seek(0)
-                out_file.seek(0)
-
-                # Read the raw bytes
-                data = in_file.read(PAGE_SIZE)
-
-                # Unpack tick number
-                tick = struct.unpack_from("I", data, offset=4)[0]
-
-                # If the tick didn't change, this is a missed tick
-                if tick == 0 or tick == previous_tick:
-                    #print("Missed Tick: {}/{} ({})".format(missed_ticks, TICKS_UNTIL_INACTIVE, tick)) # Debug missed tick number
-                    missed_ticks += 1
-                else:
-                    #print("Tick:", tick) # Debug tick number
-                    #print(data[:32].hex()) # Debug preview of data
-                    missed_ticks = 0
-                    out_file.write(data)
-                
-                previous_tick = tick
-
-                # If too many ticks are missed, go into inactive mode
-                if missed_ticks > TICKS_UNTIL_INACTIVE:
-                    time.sleep(INACTIVE_SLEEP_TIME)
-                else:
-                    time.sleep(ACTIVE_SLEEP_TIME)
+    with mmap.mmap(fileno=-1, length=MUMBLE_LINK_SIZE, tagname="MumbleLink") as in_map:
+        # The output file is mapped rather than written so that readers on the
+        # linux side can map the same pages and read them without syscalls.
+        # It is never truncated below OUTFILE_SIZE, since shrinking a file that
+        # another process has mapped makes its reads fault.
+        out_fd = os.open(OUTFILE, os.O_RDWR | os.O_CREAT | os.O_BINARY)
+        try:
+            if os.fstat(out_fd).st_size < OUTFILE_SIZE:
+                os.ftruncate(out_fd, OUTFILE_SIZE)
+            with mmap.mmap(out_fd, OUTFILE_SIZE) as out_map:
+                with memoryview(in_map) as in_view, memoryview(out_map) as out_view:
+                    run(in_view[:PAGE_SIZE], out_view)
+        finally:
+            os.close(out_fd)
+
+
+def run(in_view: memoryview, out_view: memoryview):
+    notify_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    notify_socket.setblocking(False)
+    frame_view = out_view[HEADER_SIZE:]
+    sequence = SEQUENCE.unpack_from(out_view, 0)[0] & ~1
+    scheduler = TickScheduler()
+    while True:
+        # Unpack tick number straight out of the shared memory
+        tick = struct.unpack_from("I", in_view, 4)[0]
+
+        if not scheduler.observe(tick, time.perf_counter()):
+            #print("Missed Tick: {} ({})".format(scheduler.misses, tick)) # Debug missed tick number
+            time.sleep(scheduler.sleep_time(time.perf_counter()))
+            continue
+
+        #print("Tick: {} ({:.1f}/s, jitter {:.1f}ms)".format(tick, scheduler.tick_rate, scheduler.jitter * 1000)) # Debug tick number
+        #print(in_view[:32].hex()) # Debug preview of data
+        sequence = (sequence + 1) & 0xFFFFFFFF
+        SEQUENCE.pack_into(out_view, 0, sequence)
+        frame_view[:] = in_view
+        FRAME_INFO.pack_into(out_view, FRAME_INFO_OFFSET, scheduler.tick_rate, scheduler.jitter, time.time())
+        sequence = (sequence + 1) & 0xFFFFFFFF
+        SEQUENCE.pack_into(out_view, 0, sequence)
+        try:
+            notify_socket.sendto(SEQUENCE.pack(sequence), NOTIFY_ADDRESS)
+        except OSError:
+            # Nobody is listening, or the listener is not keeping up
+            pass
+
+        time.sleep(scheduler.sleep_time(time.perf_counter()))
 
 
 if __name__ == "__main__":
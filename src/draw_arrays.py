@@ -0,0 +1,168 @@
+"""
+Converts NumPy arrays of screen coordinates into the point containers
+QPainter draws from, by copying into the container's own memory rather than
+building a Python object per point, so a whole batch is drawn in one call.
+"""
+import numpy as np
+from typing import Callable, List, Tuple, Union
+
+from PyQt5 import QtGui, QtCore, sip
+
+
+# Both QPointF and the containers below store points as pairs of doubles
+POINT_DTYPE = np.float64
+POINT_SIZE = 2 * np.dtype(POINT_DTYPE).itemsize
+
+# sip.array (PyQt5 5.15.5+) is what QPainter.drawLines takes point pairs in,
+# older versions need a QLineF object per line
+HAS_SIP_ARRAY = hasattr(sip, "array")
+
+PointPairs = Union["sip.array", list]
+PixmapFragments = Union["sip.array", list]
+
+# Columns of a QPainter.PixmapFragment, which is ten doubles: the center of
+# the fragment on screen, its source rectangle, scale, rotation and opacity
+FRAGMENT_FIELDS = ('x', 'y', 'source_left', 'source_top', 'width', 'height',
+                   'scale_x', 'scale_y', 'rotation', 'opacity')
+
+
+def polygon(points: np.ndarray) -> QtGui.QPolygonF:
+    """
+    @param points (N, 2) array of screen coordinates
+    @return QPolygonF for drawPolyline, drawPolygon or drawPoints
+    """
+    result = QtGui.QPolygonF(len(points))
+    if len(points):
+        data = result.data()
+        data.setsize(len(points) * POINT_SIZE)
+        np.frombuffer(data, POINT_DTYPE).reshape(-1, 2)[:] = points
+    return result
+
+
+def point_pairs(lines: np.ndarray) -> PointPairs:
+    """
+    @param lines (N, 4) array of (x1, y1, x2, y2) screen coordinates
+    @return Start and end points for drawLines
+    """
+    if not HAS_SIP_ARRAY:
+        return [QtCore.QLineF(*line) for line in lines.tolist()]
+    result = sip.array(QtCore.QPointF, 2 * len(lines))
+    if len(lines):
+        np.frombuffer(memoryview(result), POINT_DTYPE).reshape(-1, 4)[:] = lines
+    return result
+
+
+def pairs_bounds(pairs: PointPairs) -> QtCore.QRect:
+    """
+    @return Smallest rectangle containing every line, or an empty one
+    """
+    if not len(pairs):
+        return QtCore.QRect()
+    if isinstance(pairs, list):
+        points = np.array([(line.x1(), line.y1(), line.x2(), line.y2()) for line in pairs]).reshape(-1, 2)
+    else:
+        points = np.frombuffer(memoryview(pairs), POINT_DTYPE).reshape(-1, 2)
+    (left, top), (right, bottom) = np.floor(points.min(axis=0)), np.ceil(points.max(axis=0))
+    return QtCore.QRect(QtCore.QPoint(int(left), int(top)), QtCore.QPoint(int(right), int(bottom)))
+
+
+def pixmap_fragments(fragments: np.ndarray) -> PixmapFragments:
+    """
+    @param fragments (N, 10) array with the columns in FRAGMENT_FIELDS
+    @return Fragments for drawPixmapFragments
+    """
+    if not HAS_SIP_ARRAY:
+        return [
+            QtGui.QPainter.PixmapFragment.create(
+                QtCore.QPointF(x, y), QtCore.QRectF(left, top, width, height), scale_x, scale_y, rotation, opacity
+            )
+            for x, y, left, top, width, height, scale_x, scale_y, rotation, opacity in fragments.tolist()
+        ]
+    result = sip.array(QtGui.QPainter.PixmapFragment, len(fragments))
+    if len(fragments):
+        np.frombuffer(memoryview(result), np.float64).reshape(-1, len(FRAGMENT_FIELDS))[:] = fragments
+    return result
+
+
+def fragments_bounds(fragments: PixmapFragments) -> QtCore.QRect:
+    """
+    @return Smallest rectangle containing every fragment, or an empty one
+    """
+    if not len(fragments):
+        return QtCore.QRect()
+    if isinstance(fragments, list):
+        rows = np.array([
+            (fragment.x, fragment.y, fragment.width * fragment.scaleX, fragment.height * fragment.scaleY)
+            for fragment in fragments
+        ])
+    else:
+        columns = np.frombuffer(memoryview(fragments), np.float64).reshape(-1, len(FRAGMENT_FIELDS))
+        rows = np.column_stack((columns[:, 0], columns[:, 1], columns[:, 4] * columns[:, 6], columns[:, 5] * columns[:, 7]))
+    half_sizes = np.abs(rows[:, 2:]) / 2
+    left, top = np.floor((rows[:, :2] - half_sizes).min(axis=0))
+    right, bottom = np.ceil((rows[:, :2] + half_sizes).max(axis=0))
+    return QtCore.QRect(QtCore.QPoint(int(left), int(top)), QtCore.QPoint(int(right), int(bottom)))
+
+
+def fragment_batches(pages: np.ndarray, fragments: np.ndarray) -> List[Tuple[int, PixmapFragments]]:
+    """
+    @param pages (N,) array of the atlas page each fragment is drawn from
+    @param fragments (N, 10) array with the columns in FRAGMENT_FIELDS
+    @return (page, fragments) for each page, to draw with one call each
+    """
+    return [(page, pixmap_fragments(fragments[pages == page])) for page in np.unique(pages).tolist()]
+
+
+def batches_bounds(batches: List[Tuple[int, PixmapFragments]]) -> QtCore.QRect:
+    bounds = QtCore.QRect()
+    for _, fragments in batches:
+        bounds = bounds.united(fragments_bounds(fragments))
+    return bounds
+
+
+def same_contents(first, second) -> bool:
+    """
+    @return True if two results of the functions above, or lists or tuples
+    of them, hold the same values. sip.arrays only compare equal to
+    themselves, whatever they hold.
+    """
+    if HAS_SIP_ARRAY and isinstance(first, sip.array):
+        return (
+            isinstance(second, sip.array) and len(first) == len(second)
+            and bytes(memoryview(first)) == bytes(memoryview(second))
+        )
+    if isinstance(first, (list, tuple)):
+        return (
+            isinstance(second, type(first)) and len(first) == len(second)
+            and all(same_contents(a, b) for a, b in zip(first, second))
+        )
+    return first == second
+
+
+def draw_lines(painter: QtGui.QPainter, pairs: PointPairs) -> None:
+    if len(pairs):
+        painter.drawLines(pairs)
+
+
+def draw_polyline(painter: QtGui.QPainter, points: QtGui.QPolygonF) -> None:
+    if points.size() > 1:
+        painter.drawPolyline(points)
+
+
+def draw_points(painter: QtGui.QPainter, points: QtGui.QPolygonF) -> None:
+    if points.size():
+        painter.drawPoints(points)
+
+
+def draw_pixmap_fragments(painter: QtGui.QPainter, fragments: PixmapFragments, pixmap: QtGui.QPixmap) -> None:
+    if len(fragments):
+        painter.drawPixmapFragments(fragments, pixmap)
+
+
+def draw_fragment_batches(painter: QtGui.QPainter, batches: List[Tuple[int, PixmapFragments]],
+                          pixmap: Callable[[int], QtGui.QPixmap]) -> None:
+    """
+    @param pixmap returns the pixmap of an atlas page
+    """
+    for page, fragments in batches:
+        draw_pixmap_fragments(painter, fragments, pixmap(page))
@@ -0,0 +1,79 @@
+"""
+Chooses how often the overlay reads the link and redraws, from what the
+game reports: every frame while the view is moving, a few times a second
+while it is still (standing, loading screens, the game paused), and only
+often enough to notice the game coming back while it is unfocused or the
+map is open.
+"""
+import numpy as np
+from enum import Enum
+
+from mumble_link import LinkSnapshot, UIState
+
+
+class PacingMode(Enum):
+    ACTIVE = 0
+    STATIC = 1
+    SUSPENDED = 2
+
+
+# Seconds to wait between link reads in each mode, on top of waiting for a
+# new frame. Coming out of a slower mode takes up to one of these.
+MODE_INTERVALS = {
+    PacingMode.ACTIVE: 0.0,
+    PacingMode.STATIC: 0.1,
+    PacingMode.SUSPENDED: 0.5,
+}
+# Seconds without movement before dropping from ACTIVE to STATIC, so brief
+# pauses while moving don't cost responsiveness
+STATIC_DELAY = 0.5
+
+
+class FramePacer:
+    def __init__(self, static_delay: float = STATIC_DELAY):
+        self.static_delay = static_delay
+        self.mode = PacingMode.ACTIVE
+        self.last_motion_time = None
+        self.last_ui_tick = None
+        self.last_view = None
+
+    @staticmethod
+    def view(snapshot: LinkSnapshot) -> np.ndarray:
+        return np.concatenate((snapshot.camera_position, snapshot.camera_front, snapshot.avatar_position))
+
+    def observe(self, snapshot: LinkSnapshot, now: float) -> bool:
+        """
+        @param snapshot the latest link frame, new or not
+        @param now time.monotonic()
+        @return True if the mode changed
+        """
+        previous_mode = self.mode
+        ui_state = UIState(snapshot.ui_state)
+        if UIState.GAME_FOCUS not in ui_state or UIState.MAP_OPEN in ui_state:
+            self.mode = PacingMode.SUSPENDED
+        else:
+            # The tick stops advancing in loading screens and while paused
+            if snapshot.ui_tick != self.last_ui_tick:
+                view = self.view(snapshot)
+                if self.last_view is None or not np.array_equal(view, self.last_view):
+                    self.last_motion_time = now
+                self.last_view = view
+            if self.last_motion_time is not None and now - self.last_motion_time < self.static_delay:
+                self.mode = PacingMode.ACTIVE
+            else:
+                self.mode = PacingMode.STATIC
+        self.last_ui_tick = snapshot.ui_tick
+        return self.mode != previous_mode
+
+    def interval(self) -> float:
+        return MODE_INTERVALS[self.mode]
+
+    @property
+    def suspended(self) -> bool:
+        return self.mode is PacingMode.SUSPENDED
+
+    def describe(self) -> str:
+        interval = self.interval()
+        if not interval:
+            return "{} (every frame)".format(self.mode.name)
+        return "{} ({:g} Hz)".format(self.mode.name, 1 / interval)
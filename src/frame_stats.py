@@ -0,0 +1,115 @@
+"""
+Times the stages of producing a frame (reading the link, building the
+camera, projecting, painting...) so it is clear where frame time goes under
+real load. The last few hundred times of each stage are kept in fixed size
+ring buffers and summarized as percentiles, for the overlay's HUD or for
+export to JSON or CSV.
+
+Recording a time is a perf_counter() call and an array store, cheap enough
+to leave on all the time. Stages may be recorded from any thread.
+"""
+import csv
+import json
+import threading
+import time
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+# Stages of a frame, in the order they happen
+STAGES = ("link read", "identity decode", "camera build", "culling", "projection", "bounds", "paint")
+# Times kept per stage
+STATS_CAPACITY = 1024
+PERCENTILES = (50, 95, 99)
+
+
+class RingBuffer:
+    def __init__(self, capacity: int = STATS_CAPACITY):
+        self.values = np.zeros(capacity)
+        self.count = 0
+
+    def append(self, value: float) -> None:
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+
+    def recent(self) -> np.ndarray:
+        """
+        @return The values kept, oldest first
+        """
+        if self.count <= len(self.values):
+            return self.values[:self.count].copy()
+        start = self.count % len(self.values)
+        return np.concatenate((self.values[start:], self.values[:start]))
+
+
+class FrameStats:
+    def __init__(self, capacity: int = STATS_CAPACITY):
+        self.capacity = capacity
+        self.buffers: Dict[str, RingBuffer] = {stage: RingBuffer(capacity) for stage in STAGES}
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            buffer = self.buffers.get(stage)
+            if buffer is None:
+                buffer = self.buffers[stage] = RingBuffer(self.capacity)
+            buffer.append(seconds)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        @return For each stage recorded at least once, the number of times
+        recorded in total and the mean, percentiles and maximum of the
+        recent ones in milliseconds
+        """
+        with self.lock:
+            recent = {stage: (buffer.count, buffer.recent()) for stage, buffer in self.buffers.items()}
+        summary = {}
+        for stage, (count, values) in recent.items():
+            if not count:
+                continue
+            values = values * 1000
+            summary[stage] = dict(count=count, mean=float(values.mean()))
+            for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES).tolist()):
+                summary[stage]["p{}".format(percentile)] = value
+            summary[stage]["max"] = float(values.max())
+        return summary
+
+    def report(self) -> List[str]:
+        """
+        @return One line per stage, for printing or the HUD
+        """
+        lines = ["{:<16}{:>8}{:>8}{:>8}".format("ms", *("p{}".format(p) for p in PERCENTILES))]
+        for stage, values in self.summary().items():
+            lines.append("{:<16}{:>8.2f}{:>8.2f}{:>8.2f}".format(
+                stage, *(values["p{}".format(p)] for p in PERCENTILES)
+            ))
+        return lines
+
+    def export(self, path: str, file_format: Optional[str] = None) -> None:
+        """
+        Writes the summary to path
+        @param file_format "json" or "csv", by default taken from the extension
+        """
+        if file_format is None:
+            file_format = "csv" if path.lower().endswith(".csv") else "json"
+        summary = self.summary()
+        with open(path, "w", newline="") as f:
+            if file_format == "csv":
+                fields = ["count", "mean"] + ["p{}".format(p) for p in PERCENTILES] + ["max"]
+                writer = csv.writer(f)
+                writer.writerow(["stage"] + fields)
+                for stage, values in summary.items():
+                    writer.writerow([stage] + [values[field] for field in fields])
+            elif file_format == "json":
+                json.dump(summary, f, indent=4)
+            else:
+                raise ValueError("unknown stats format: {}".format(file_format))
@@ -1,5 +1,6 @@
+import weakref
 import numpy as np
-from scipy.spatial.transform import Rotation
+from typing import Tuple
 
 
 class Vector:
@@ -43,6 +44,13 @@ class Vector:
     def dot(self, other):
         return type(self)(np.dot(self._np_arr, other._np_arr))
 
+    def lerp(self, other, t: float):
+        """
+        @return Linear interpolation from self (t=0) to other (t=1), continuing
+        along the same line for t outside of [0, 1]
+        """
+        return type(self)(self._np_arr + (other._np_arr - self._np_arr) * t)
+
     @classmethod
     def origin(cls):
         return cls(np.array([0] * cls._size))
@@ -135,14 +143,33 @@ class Vector3(Vector):
     def backward(cls):
         return cls(np.array([0, 0, -1]))
 
-    def rotate(self, rotation: Rotation, origin = None):
+    def rotate(self, rotation: 'Quaternion', origin = None):
+        """
+        @param rotation a Quaternion, or anything else with an apply() method
+        such as a scipy Rotation
+        """
         if origin is None:
             origin = Vector3.origin()
         return Vector3(np.add(rotation.apply(np.subtract(self._np_arr, origin._np_arr)), origin._np_arr))
 
-    def rotationTo(self, other) -> Rotation:
-        rotation, _ = Rotation.align_vectors([other._np_arr], [self._np_arr])
-        return rotation
+    def slerp(self, other, t: float):
+        """
+        @return Spherical interpolation between the directions of self (t=0)
+        and other (t=1), continuing the same rotation for t outside of [0, 1]
+        """
+        a = self.normalize()._np_arr
+        b = other.normalize()._np_arr
+        omega = np.arccos(np.clip(np.dot(a, b), -1, 1))
+        if omega < 1e-6:
+            return Vector3(a + (b - a) * t).normalize()
+        sin_omega = np.sin(omega)
+        # Opposite directions have no unique rotation between them
+        if sin_omega < 1e-6:
+            return Vector3(a if t < 0.5 else b)
+        return Vector3(a * (np.sin((1 - t) * omega) / sin_omega) + b * (np.sin(t * omega) / sin_omega))
+
+    def rotationTo(self, other) -> 'Quaternion':
+        return Quaternion.align(self, other)
 
 
 class Vector4(Vector):
@@ -181,6 +208,212 @@ class Vector4(Vector):
         self._np_arr[3] = value
 
 
+def _component(index: int) -> property:
+    """
+    @return Property exposing one column of a VectorArray as a view
+    """
+    def getter(self):
+        return self._np_arr[:, index]
+
+    def setter(self, value):
+        self._np_arr[:, index] = value
+
+    return property(getter, setter)
+
+
+class VectorArray:
+    """
+    N vectors stored as the rows of one contiguous (N, size) array. Component
+    properties, slices and single vectors are views into that array, and the
+    vector operations work on every row at once.
+    """
+    __slots__ = ('_np_arr',)
+    _size = 1
+    _vector_type = Vector
+
+    def __init__(self, arr=None, count: int = 0, dtype=float):
+        if arr is None:
+            arr = np.zeros((count, self._size), dtype=dtype)
+        self._np_arr = arr
+
+    @classmethod
+    def of(cls, vectors):
+        return cls(np.array([vector._np_arr for vector in vectors], dtype=float).reshape(-1, cls._size))
+
+    def __len__(self):
+        return len(self._np_arr)
+
+    def __iter__(self):
+        for row in self._np_arr:
+            yield self._vector_type(row)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self._vector_type(self._np_arr[key])
+        return type(self)(self._np_arr[key])
+
+    def __setitem__(self, key, value):
+        if isinstance(value, (Vector, VectorArray)):
+            value = value._np_arr
+        self._np_arr[key] = value
+
+    def __mul__(self, other):
+        cls = type(self)
+        if cls is not type(other):
+            raise TypeError("VectorArray multiplication type mismatch: {} vs {}".format(cls, type(other)))
+        return cls(self._np_arr * other._np_arr)
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(repr(vector) for vector in self))
+
+    __str__ = __repr__
+
+    def normalize(self):
+        return type(self)(self._np_arr / np.linalg.norm(self._np_arr, axis=1, keepdims=True))
+
+    def cross(self, other):
+        return type(self)(np.cross(self._np_arr, other._np_arr))
+
+    def dot(self, other) -> np.ndarray:
+        """
+        @return (N,) array of the dot product of each pair of rows
+        """
+        return np.einsum('ij,ij->i', self._np_arr, other._np_arr)
+
+    def lerp(self, other, t):
+        """
+        @param t a scalar, or an (N,) array with a factor per row
+        """
+        t = np.asarray(t, dtype=float)
+        if t.ndim:
+            t = t[:, np.newaxis]
+        return type(self)(self._np_arr + (other._np_arr - self._np_arr) * t)
+
+
+class Vector2Array(VectorArray):
+    __slots__ = ()
+    _size = 2
+    _vector_type = Vector2
+
+    x = _component(0)
+    y = _component(1)
+
+
+class Vector3Array(VectorArray):
+    __slots__ = ()
+    _size = 3
+    _vector_type = Vector3
+
+    x = _component(0)
+    y = _component(1)
+    z = _component(2)
+
+    def rotate(self, rotation: 'Quaternion', origin: Vector3 = None):
+        if origin is None:
+            return Vector3Array(rotation.apply(self._np_arr))
+        return Vector3Array(rotation.apply(self._np_arr - origin._np_arr) + origin._np_arr)
+
+
+class Vector4Array(VectorArray):
+    __slots__ = ()
+    _size = 4
+    _vector_type = Vector4
+
+    x = _component(0)
+    y = _component(1)
+    z = _component(2)
+    w = _component(3)
+
+
+class Quaternion:
+    """
+    A rotation stored as a unit quaternion in (x, y, z, w) order, the same
+    order scipy uses. Covers what the overlay needs without importing scipy,
+    which is slow to load; as_scipy() converts when more is needed.
+    """
+    __slots__ = ('_np_arr',)
+
+    def __init__(self, arr=None):
+        if arr is None:
+            arr = np.array([0.0, 0.0, 0.0, 1.0])
+        self._np_arr = arr
+
+    def __repr__(self):
+        return "Quaternion(x={},y={},z={},w={})".format(*self._np_arr)
+
+    __str__ = __repr__
+
+    def __mul__(self, other):
+        """
+        @return The rotation applying other first and then self
+        """
+        x1, y1, z1, w1 = self._np_arr
+        x2, y2, z2, w2 = other._np_arr
+        return Quaternion(np.array([
+            w1*x2 + x1*w2 + y1*z2 - z1*y2,
+            w1*y2 - x1*z2 + y1*w2 + z1*x2,
+            w1*z2 + x1*y2 - y1*x2 + z1*w2,
+            w1*w2 - x1*x2 - y1*y2 - z1*z2,
+        ]))
+
+    @classmethod
+    def identity(cls):
+        return cls()
+
+    @classmethod
+    def from_rotvec(cls, rotvec: np.ndarray):
+        """
+        @param rotvec rotation axis scaled by the angle in radians
+        """
+        angle = np.linalg.norm(rotvec)
+        if angle < 1e-12:
+            return cls()
+        axis = np.asarray(rotvec) / angle
+        return cls(np.append(axis * np.sin(angle / 2), np.cos(angle / 2)))
+
+    @classmethod
+    def align(cls, start: Vector3, stop: Vector3):
+        """
+        @return The smallest rotation taking the direction of start onto the
+        direction of stop
+        """
+        a = start.normalize()._np_arr
+        b = stop.normalize()._np_arr
+        axis = np.cross(a, b)
+        sin_angle = np.linalg.norm(axis)
+        cos_angle = np.dot(a, b)
+        if sin_angle < 1e-12:
+            if cos_angle > 0:
+                return cls()
+            # Opposite directions: turn half way around any perpendicular axis
+            axis = np.cross(a, (1.0, 0.0, 0.0))
+            if np.linalg.norm(axis) < 1e-6:
+                axis = np.cross(a, (0.0, 1.0, 0.0))
+            return cls.from_rotvec(axis / np.linalg.norm(axis) * np.pi)
+        return cls.from_rotvec(axis / sin_angle * np.arctan2(sin_angle, cos_angle))
+
+    def inverse(self):
+        return Quaternion(self._np_arr * (-1, -1, -1, 1))
+
+    def as_matrix(self) -> np.ndarray:
+        x, y, z, w = self._np_arr
+        return np.array([
+            [1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)],
+            [2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)],
+            [2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)],
+        ])
+
+    def apply(self, points: np.ndarray) -> np.ndarray:
+        """
+        @param points a (3,) vector or an (N, 3) array of vectors
+        """
+        return np.asarray(points) @ self.as_matrix().T
+
+    def as_scipy(self):
+        from scipy.spatial.transform import Rotation
+        return Rotation.from_quat(self._np_arr)
+
+
 class TransformMatrix:
     __slots__ = ('_np_arr',)
 
@@ -211,6 +444,18 @@ class TransformMatrix:
     def inverse(self):
         return type(self)(np.linalg.inv(self._np_arr))
 
+    def rigid_inverse(self):
+        """
+        Inverse of a transform made of only a rotation and a translation,
+        computed in closed form as the transposed rotation and the rotated
+        negative translation.
+        """
+        rotation = self._np_arr[:3, :3].T
+        result = np.identity(4)
+        result[:3, :3] = rotation
+        result[:3, 3] = -rotation @ self._np_arr[:3, 3]
+        return type(self)(result)
+
     def __repr__(self) -> str:
         return repr(self._np_arr)
 
@@ -218,4 +463,107 @@ class TransformMatrix:
         return str(self._np_arr)
 
     def transpose(self):
-        return type(self)(np.transpose(self._np_arr))
\ No newline at end of file
+        return type(self)(np.transpose(self._np_arr))
+
+
+# Default edge length of a SpatialGrid cell, in world units
+GRID_CELL_SIZE = 32.0
+
+
+class SpatialGrid:
+    """
+    A uniform grid over a fixed set of points (such as the markers of one
+    map), so frustum and radius queries only have to look at the points in
+    nearby cells. Cells are stored sorted and tested as whole arrays, so a
+    query costs a few vectorized passes over the occupied cells rather than
+    a pass over every point.
+    """
+    # Grids by map id and id() of their points array, see cached(). Only
+    # kept while something (a scene node) holds on to them.
+    _maps: 'weakref.WeakValueDictionary[Tuple[int, int], SpatialGrid]' = weakref.WeakValueDictionary()
+
+    def __init__(self, points: np.ndarray, cell_size: float = GRID_CELL_SIZE):
+        """
+        @param points (N, 3) array of world positions, query results are
+        indices into it
+        """
+        self.points = points
+        self.cell_size = cell_size
+        cells = np.floor(points / cell_size).astype(np.int64)
+        _, cell_of_point = np.unique(cells, axis=0, return_inverse=True)
+        cell_of_point = cell_of_point.reshape(-1)
+        # Point indices grouped by cell, each cell being one contiguous run
+        self.order = np.argsort(cell_of_point, kind='stable')
+        self.counts = np.bincount(cell_of_point)
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1])).astype(np.int64)
+        # Tight bounds of the points in each cell, which cull better than
+        # the cell itself
+        if len(points):
+            sorted_points = points[self.order]
+            self.cell_min = np.minimum.reduceat(sorted_points, self.starts)
+            self.cell_max = np.maximum.reduceat(sorted_points, self.starts)
+        else:
+            self.cell_min = self.cell_max = np.zeros((0, 3))
+
+    @classmethod
+    def cached(cls, map_id: int, points: np.ndarray, cell_size: float = GRID_CELL_SIZE) -> 'SpatialGrid':
+        """
+        @return The grid of points on a map, shared by every caller with the
+        same points array, and only built the first time it is asked for
+        """
+        key = (map_id, id(points))
+        grid = cls._maps.get(key)
+        # An id can be reused once its array is gone
+        if grid is None or grid.points is not points or grid.cell_size != cell_size:
+            grid = cls._maps[key] = cls(points, cell_size)
+        return grid
+
+    @classmethod
+    def drop_other_maps(cls, map_id: int) -> None:
+        """
+        Forgets the grids of every map but map_id, such as when the player
+        leaves a map. Nodes still using one keep their own reference to it.
+        """
+        for key in list(cls._maps.keys()):
+            if key[0] != map_id:
+                cls._maps.pop(key, None)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _gather(self, cells: np.ndarray) -> np.ndarray:
+        """
+        @param cells boolean mask of the cells to take
+        @return Indices of every point in those cells
+        """
+        starts = self.starts[cells]
+        counts = self.counts[cells]
+        # Offset of every point within the concatenation of the chosen runs
+        run_offsets = np.cumsum(counts) - counts
+        positions = np.repeat(starts - run_offsets, counts) + np.arange(counts.sum())
+        return self.order[positions]
+
+    def query_frustum(self, planes: np.ndarray) -> np.ndarray:
+        """
+        @param planes (P, 4) array of planes (a, b, c, d), with the inside of
+        the frustum where a*x + b*y + c*z + d >= 0, such as Camera.frustum_planes
+        @return Indices of the points in every cell that may be inside the
+        frustum. Some may still be outside, the projection is the exact test.
+        """
+        inside = np.ones(len(self.counts), dtype=bool)
+        for normal, offset in zip(planes[:, :3], planes[:, 3]):
+            # The corner of each cell furthest along the plane normal
+            corner = np.where(normal >= 0, self.cell_max, self.cell_min)
+            inside &= corner @ normal + offset >= 0
+        return self._gather(inside)
+
+    def query_radius(self, center: np.ndarray, radius: float) -> np.ndarray:
+        """
+        @param center (3,) world position
+        @return Indices of the points within radius of center
+        """
+        # Distance from the center to the nearest point of each cell's bounds
+        gap = np.maximum(np.maximum(self.cell_min - center, center - self.cell_max), 0)
+        candidates = self._gather(np.einsum('ij,ij->i', gap, gap) <= radius * radius)
+        offsets = self.points[candidates] - center
+        return candidates[np.einsum('ij,ij->i', offsets, offsets) <= radius * radius]
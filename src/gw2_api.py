@@ -1,5 +1,4 @@
 import json
-import requests
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Any, Dict, Optional, Tuple
@@ -66,7 +65,9 @@ class GW2API:
         if now < expiration:
             return result
 
-        # Get a new result from the api and set the expiration
+        # Get a new result from the api and set the expiration. requests is
+        # slow to import and most lookups are served from the caches.
+        import requests
         result = requests.get(self.URL_BASE + endpoint, headers=self.api_headers).json()
         expiration = now + timedelta(seconds=cache_seconds)
         self.CACHE[endpoint] = (result, expiration)
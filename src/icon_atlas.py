@@ -0,0 +1,230 @@
+"""
+Packs marker icons into a few large atlas pages, each icon pre-scaled to a
+handful of sizes, so any number of icons can be drawn with one
+drawPixmapFragments call per page instead of loading and scaling a pixmap
+per marker.
+
+Icons are decoded when first used and every size is packed at once. Pages
+are evicted whole, least recently used first, once the memory budget is
+reached; an evicted icon is decoded again the next time it is used. Pages
+used within the last MIN_PAGE_AGE seconds may still be on screen and are
+never evicted, the atlas goes over budget instead. Whoever keeps fragments
+of a page around without looking it up again (retained scene primitives)
+must keep_pages() it, or it may be refilled with other icons.
+
+The same packing holds any other image drawn often, such as rendered text
+(see label_cache.py), through lookup_image().
+
+Lookups may happen on the frame worker thread while the GUI thread draws,
+so pages are kept as QImages and only turned into QPixmaps by pixmap(),
+which must be called from the GUI thread.
+"""
+import threading
+import time
+from typing import Callable, Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+
+from PyQt5 import QtGui, QtCore
+
+
+# Pixel sizes every icon is pre-scaled to, largest first
+ICON_LEVELS = (128, 64, 32, 16)
+ATLAS_PAGE_SIZE = 1024
+ATLAS_BUDGET = 64 * 1024 * 1024
+# Transparent border around each packed icon, so smooth scaling when drawing
+# never samples its neighbours
+ICON_PADDING = 1
+MIN_PAGE_AGE = 0.5
+
+
+class AtlasEntry(NamedTuple):
+    page: int
+    # Source rectangle of the icon within its page
+    left: int
+    top: int
+    width: int
+    height: int
+    level: int
+
+
+class AtlasPage:
+    def __init__(self, size: int):
+        self.size = size
+        self.image = QtGui.QImage(size, size, QtGui.QImage.Format_ARGB32_Premultiplied)
+        self.image.fill(QtCore.Qt.transparent)
+        # Rows of icons as [top, height, used width]
+        self.shelves: List[List[int]] = []
+        self.keys = set()
+        self.last_used = 0.0
+        # Bumped on every change, so the GUI thread knows to refresh pixmap
+        self.version = 0
+        self.pixmap: Optional[QtGui.QPixmap] = None
+        self.pixmap_version = -1
+
+    def clear(self):
+        self.image.fill(QtCore.Qt.transparent)
+        self.shelves = []
+        self.keys = set()
+        self.version += 1
+
+    def allocate(self, width: int, height: int) -> Optional[Tuple[int, int]]:
+        """
+        @return Top left corner of a free width x height area, or None if
+        the page is full
+        """
+        for shelf in self.shelves:
+            top, shelf_height, used = shelf
+            if height <= shelf_height and used + width <= self.size:
+                shelf[2] += width
+                return used, top
+        top = self.shelves[-1][0] + self.shelves[-1][1] if self.shelves else 0
+        if top + height > self.size or width > self.size:
+            return None
+        self.shelves.append([top, height, width])
+        return 0, top
+
+
+class IconAtlas:
+    def __init__(self, budget: int = ATLAS_BUDGET, levels: Tuple[int, ...] = ICON_LEVELS,
+                 page_size: int = ATLAS_PAGE_SIZE):
+        """
+        @param budget bytes of atlas pages to keep before evicting
+        @param levels pixel sizes every icon is pre-scaled to
+        """
+        self.levels = tuple(sorted(levels, reverse=True))
+        self.page_size = page_size
+        self.max_pages = max(1, budget // (page_size * page_size * 4))
+        self.pages: List[AtlasPage] = []
+        # (path, level), or the key given to lookup_image -> AtlasEntry
+        self.entries: Dict[Hashable, AtlasEntry] = {}
+        self.missing = set()
+        self.lock = threading.Lock()
+
+    @property
+    def memory_used(self) -> int:
+        return len(self.pages) * self.page_size * self.page_size * 4
+
+    def level_for(self, size: float) -> int:
+        """
+        @return The smallest pre-scaled size at least as large as size
+        """
+        for level in reversed(self.levels):
+            if level >= size:
+                return level
+        return self.levels[0]
+
+    def lookup(self, path: str, size: float) -> Optional[AtlasEntry]:
+        """
+        @param size pixel size the icon will be drawn at
+        @return Where the icon is packed at the level best suited to size, or
+        None if it can't be loaded
+        """
+        key = (path, self.level_for(size))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if path in self.missing or not self.insert(path):
+                    return None
+                entry = self.entries[key]
+            self.pages[entry.page].last_used = time.monotonic()
+            return entry
+
+    def lookup_image(self, key: Hashable, render: Callable[[], QtGui.QImage]) -> AtlasEntry:
+        """
+        @param render called to draw the image the first time key is looked
+        up, or again after it was evicted
+        @return Where the image is packed, at its own size and with level 0
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.pack(key, render(), 0)
+            self.pages[entry.page].last_used = time.monotonic()
+            return entry
+
+    def keep_pages(self, pages: Iterable[int]) -> None:
+        """
+        Marks pages as just used, so they aren't evicted while still drawn from
+        """
+        now = time.monotonic()
+        with self.lock:
+            for page in pages:
+                self.pages[page].last_used = now
+
+    def insert(self, path: str) -> bool:
+        """
+        Decodes an icon and packs every level of it that isn't packed already
+        @return False if the icon couldn't be loaded
+        """
+        image = QtGui.QImage(path)
+        if image.isNull():
+            print("Failed to load icon", path)
+            self.missing.add(path)
+            return False
+        image = image.convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+        for level in self.levels:
+            key = (path, level)
+            if key not in self.entries:
+                scaled = image.scaled(level, level, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+                self.pack(key, scaled, level)
+        return True
+
+    def pack(self, key: Hashable, image: QtGui.QImage, level: int) -> AtlasEntry:
+        page_index, (left, top) = self.allocate(image.width() + 2 * ICON_PADDING, image.height() + 2 * ICON_PADDING)
+        page = self.pages[page_index]
+        painter = QtGui.QPainter(page.image)
+        painter.setCompositionMode(QtGui.QPainter.CompositionMode_Source)
+        painter.drawImage(left + ICON_PADDING, top + ICON_PADDING, image)
+        painter.end()
+        page.keys.add(key)
+        page.version += 1
+        entry = self.entries[key] = AtlasEntry(
+            page_index, left + ICON_PADDING, top + ICON_PADDING, image.width(), image.height(), level
+        )
+        return entry
+
+    def allocate(self, width: int, height: int) -> Tuple[int, Tuple[int, int]]:
+        """
+        @return Index of a page with room for the area, and where in it
+        """
+        # Fill the pages in use first, so stale pages stay stale and can be
+        # evicted rather than being kept alive by a few new icons
+        for page_index in sorted(range(len(self.pages)), key=lambda index: -self.pages[index].last_used):
+            page = self.pages[page_index]
+            corner = page.allocate(width, height)
+            if corner is not None:
+                page.last_used = time.monotonic()
+                return page_index, corner
+
+        page_index = len(self.pages)
+        if len(self.pages) >= self.max_pages:
+            # Reuse the least recently used page, unless it may be on screen,
+            # in which case going over budget is the lesser evil
+            least_used = min(range(len(self.pages)), key=lambda index: self.pages[index].last_used)
+            if time.monotonic() - self.pages[least_used].last_used > MIN_PAGE_AGE:
+                self.evict(least_used)
+                page_index = least_used
+        if page_index == len(self.pages):
+            self.pages.append(AtlasPage(self.page_size))
+        self.pages[page_index].last_used = time.monotonic()
+        corner = self.pages[page_index].allocate(width, height)
+        if corner is None:
+            raise ValueError("icon of {}x{} does not fit in an atlas page".format(width, height))
+        return page_index, corner
+
+    def evict(self, page_index: int) -> None:
+        page = self.pages[page_index]
+        for key in page.keys:
+            del self.entries[key]
+        page.clear()
+
+    def pixmap(self, page_index: int) -> QtGui.QPixmap:
+        """
+        @return The page as a pixmap, only converted again when it changed.
+        GUI thread only.
+        """
+        page = self.pages[page_index]
+        with self.lock:
+            if page.pixmap_version != page.version:
+                page.pixmap = QtGui.QPixmap.fromImage(page.image)
+                page.pixmap_version = page.version
+            return page.pixmap
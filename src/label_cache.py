@@ -0,0 +1,137 @@
+"""
+Caches rendered text for the overlay. Each distinct label (marker names, the
+box corner labels) is rendered once into the pages of a TextAtlas, shared by
+everything drawing text in the same font and color, and a node's labels are
+then drawn with one drawPixmapFragments call per page instead of laying out
+every string every frame.
+
+Numbers that change every frame (distances) would fill the atlas with
+strings used once, so they are instead assembled from single rendered
+characters placed by their advances.
+"""
+import numpy as np
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from PyQt5 import QtGui, QtCore
+
+from draw_arrays import PixmapFragments, FRAGMENT_FIELDS, fragment_batches
+from icon_atlas import IconAtlas
+
+
+TEXT_ATLAS_BUDGET = 16 * 1024 * 1024
+TEXT_PAGE_SIZE = 1024
+
+
+class TextAtlas:
+    # (font key, color) -> the atlas shared by all text drawn in that style
+    CACHE: Dict[Tuple[str, int], 'TextAtlas'] = {}
+
+    def __init__(self, font: QtGui.QFont, color: QtGui.QColor, budget: int = TEXT_ATLAS_BUDGET):
+        self.font = QtGui.QFont(font)
+        self.color = QtGui.QColor(color)
+        metrics = QtGui.QFontMetrics(font)
+        self.metrics = metrics
+        self.ascent = metrics.ascent()
+        self.height = metrics.height()
+        # Text is rendered a little wider than its advance, so glyphs that
+        # overhang it aren't clipped
+        self.padding = max(1, metrics.maxWidth() // 4)
+        self.atlas = IconAtlas(budget=budget, levels=(0,), page_size=TEXT_PAGE_SIZE)
+        # Per character advances, for glyph_fragments
+        self.advances: Dict[str, int] = {}
+
+    @classmethod
+    def shared(cls, font: QtGui.QFont, color: QtGui.QColor) -> 'TextAtlas':
+        key = (font.key(), QtGui.QColor(color).rgba())
+        atlas = cls.CACHE.get(key)
+        if atlas is None:
+            atlas = cls.CACHE[key] = cls(font, color)
+        return atlas
+
+    def render(self, text: str) -> QtGui.QImage:
+        """
+        @return text drawn with the left end of its baseline at
+        (padding, padding + ascent)
+        """
+        width = self.metrics.horizontalAdvance(text) + 2 * self.padding
+        image = QtGui.QImage(width, self.height + 2 * self.padding, QtGui.QImage.Format_ARGB32_Premultiplied)
+        image.fill(QtCore.Qt.transparent)
+        painter = QtGui.QPainter(image)
+        painter.setFont(self.font)
+        painter.setPen(self.color)
+        painter.drawText(self.padding, self.padding + self.ascent, text)
+        painter.end()
+        return image
+
+    def entries(self, keys: Sequence[str], kind: str) -> np.ndarray:
+        """
+        @return (N, 5) array of page, left, top, width and height for the
+        rendered image of each key
+        """
+        entries = [
+            self.atlas.lookup_image((kind, key), lambda key=key: self.render(key))[:5]
+            for key in keys
+        ]
+        return np.array(entries, dtype=float).reshape(-1, 5)
+
+    def pixmap(self, page: int) -> QtGui.QPixmap:
+        """
+        GUI thread only
+        """
+        return self.atlas.pixmap(page)
+
+    def keep_pages(self, pages: Iterable[int]) -> None:
+        self.atlas.keep_pages(pages)
+
+    def width(self, text: str) -> int:
+        return self.metrics.horizontalAdvance(text)
+
+    def fragments(self, origins: np.ndarray, entries: np.ndarray) -> List[Tuple[int, PixmapFragments]]:
+        """
+        @param origins (N, 2) array of the left end of each baseline
+        @param entries (N, 5) array of where each image is, as from entries()
+        """
+        fragments = np.zeros((len(origins), len(FRAGMENT_FIELDS)))
+        fragments[:, 2:6] = entries[:, 1:5]
+        fragments[:, 0] = origins[:, 0] - self.padding + entries[:, 3] / 2
+        fragments[:, 1] = origins[:, 1] - self.ascent - self.padding + entries[:, 4] / 2
+        fragments[:, 6:8] = 1
+        fragments[:, 9] = 1
+        return fragment_batches(entries[:, 0].astype(int), fragments)
+
+    def label_fragments(self, positions: np.ndarray, texts: Sequence[str]) -> List[Tuple[int, PixmapFragments]]:
+        """
+        @param positions (N, 2) array of the left end of each text's baseline,
+        like QPainter.drawText takes
+        @return (page, fragments) drawing every text, rendering the ones not
+        seen before
+        """
+        if not len(texts):
+            return []
+        unique, inverse = np.unique(np.asarray(texts, dtype=str), return_inverse=True)
+        entries = self.entries(unique.tolist(), "label")[inverse]
+        return self.fragments(np.asarray(positions, dtype=float).reshape(-1, 2), entries)
+
+    def glyph_fragments(self, positions: np.ndarray, texts: Sequence[str]) -> List[Tuple[int, PixmapFragments]]:
+        """
+        Like label_fragments, but draws each character separately, for text
+        that rarely repeats. Kerning between characters is lost.
+        """
+        lengths = np.array([len(text) for text in texts], dtype=int)
+        codes = np.frombuffer("".join(texts).encode("utf-32-le"), np.uint32)
+        if not len(codes):
+            return []
+        unique, glyphs = np.unique(codes, return_inverse=True)
+        characters = [chr(code) for code in unique.tolist()]
+        for character in characters:
+            if character not in self.advances:
+                self.advances[character] = self.metrics.horizontalAdvance(character)
+        advances = np.array([self.advances[character] for character in characters], dtype=float)[glyphs]
+        entries = self.entries(characters, "glyph")[glyphs]
+        # Each character starts where the previous ones of its text end
+        starts = np.cumsum(lengths) - lengths
+        cursor = np.cumsum(advances) - advances
+        cursor -= np.repeat(cursor[np.minimum(starts, len(codes) - 1)], lengths)
+        origins = np.repeat(np.asarray(positions, dtype=float).reshape(-1, 2), lengths, axis=0)
+        origins[:, 0] += cursor
+        return self.fragments(origins, entries)
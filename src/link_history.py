@@ -0,0 +1,150 @@
+"""
+A fixed size ring buffer of recent decoded link frames with their publish
+timestamps, kept in shared memory so any number of tools can read movement
+history without keeping their own copies.
+
+There is a single writer (link_hub.py, or a process keeping a private
+history). Readers never lock: they copy the frames they want and then drop
+any the writer may have overwritten while they were copying.
+"""
+import mmap
+import os
+import numpy as np
+from typing import Optional, Tuple
+
+from mumble_link import LinkSnapshot
+
+
+HISTORY_PATH = "/dev/shm/gw2_link_history"
+HISTORY_CAPACITY = 1024
+
+FRAME_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('ui_tick', '<u4'),
+    ('map_id', '<u4'),
+    ('ui_state', '<u4'),
+    ('avatar_position', '<f4', 3),
+    ('avatar_front', '<f4', 3),
+    ('camera_position', '<f4', 3),
+    ('camera_front', '<f4', 3),
+    ('camera_top', '<f4', 3),
+])
+# The header holds the total number of frames ever written, which is only
+# advanced once a frame is completely written, and the capacity. Each writer
+# attaching to the history starts a new generation, whose frames begin at
+# first; count carries on, so it never goes backwards under readers.
+HEADER_DTYPE = np.dtype([
+    ('count', '<u8'),
+    ('capacity', '<u4'),
+    ('generation', '<u4'),
+    ('first', '<u8'),
+])
+HEADER_SIZE = 64
+
+
+class LinkHistory:
+    def __init__(self, path: Optional[str] = HISTORY_PATH, capacity: int = HISTORY_CAPACITY, writable: bool = True):
+        """
+        @param path shared memory file, or None for a history private to this process
+        @param capacity number of frames kept, only used when creating the history
+        @param writable create the history, or start a new generation of it,
+        and write to it, rather than attach to one written by another process
+        """
+        self.path = path
+        self.writable = writable
+        if path is None:
+            size = HEADER_SIZE + capacity * FRAME_DTYPE.itemsize
+            self.map = mmap.mmap(-1, size)
+        elif writable:
+            size = HEADER_SIZE + capacity * FRAME_DTYPE.itemsize
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                # Resizing faults readers that have it mapped, so it is
+                # only done when the capacity changed
+                if os.fstat(fd).st_size != size:
+                    os.ftruncate(fd, size)
+                self.map = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        else:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                self.map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+
+        self.header = np.frombuffer(self.map, HEADER_DTYPE, count=1)
+        if writable:
+            # Frames of a previous writer are dropped by moving first past
+            # them rather than zeroing count in place, which readers
+            # copying at the time couldn't tell from frames being added
+            self.header['capacity'] = capacity
+            self.header['first'] = self.header['count']
+            self.header['generation'] += 1
+        self.capacity = int(self.header['capacity'][0])
+        self.frames = np.frombuffer(self.map, FRAME_DTYPE, count=self.capacity, offset=HEADER_SIZE)
+
+    @classmethod
+    def attach(cls, path: str = HISTORY_PATH) -> 'LinkHistory':
+        return cls(path, writable=False)
+
+    def close(self):
+        del self.header, self.frames
+        self.map.close()
+
+    @property
+    def count(self) -> int:
+        """
+        @return Total number of frames ever appended
+        """
+        return int(self.header['count'][0])
+
+    def append(self, snapshot: LinkSnapshot, timestamp: float) -> None:
+        count = self.count
+        # Keep timestamps monotonic even if the publisher's clock steps back
+        if count > self.header['first'][0]:
+            timestamp = max(timestamp, self.frames[(count - 1) % self.capacity]['timestamp'])
+        frame = self.frames[count % self.capacity]
+        frame['timestamp'] = timestamp
+        frame['ui_tick'] = snapshot.ui_tick
+        frame['map_id'] = snapshot.map_id
+        frame['ui_state'] = snapshot.ui_state
+        frame['avatar_position'] = snapshot.avatar_position
+        frame['avatar_front'] = snapshot.avatar_front
+        frame['camera_position'] = snapshot.camera_position
+        frame['camera_front'] = snapshot.camera_front
+        frame['camera_top'] = snapshot.camera_top
+        # Publishing the frame is a single aligned 8 byte store
+        self.header['count'] = count + 1
+
+    def recent(self, n: int = None) -> np.ndarray:
+        """
+        @return Copy of up to the last n frames, oldest first
+        """
+        if n is None or n > self.capacity:
+            n = self.capacity
+        generation = int(self.header['generation'][0])
+        end = self.count
+        start = max(int(self.header['first'][0]), end - n, 0)
+        frames = self.frames[np.arange(start, end) % self.capacity]
+        # While copying, the writer may have started overwriting the slot of
+        # frame (latest count - capacity), and every slot before it
+        oldest_valid = self.count - self.capacity + 1
+        if oldest_valid > start:
+            frames = frames[oldest_valid - start:]
+        # A new writer took over while copying, none of it can be trusted
+        if int(self.header['generation'][0]) != generation:
+            return frames[:0]
+        return frames
+
+    def samples(self, field: str, n: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        @return (timestamps, values) of a field over up to the last n frames,
+        such as an (N,) array of times and an (N, 3) array of camera positions
+        """
+        frames = self.recent(n)
+        return frames['timestamp'].copy(), frames[field].astype(float)
+
+    def latest(self) -> Optional[np.void]:
+        frames = self.recent(1)
+        return frames[0] if len(frames) else None
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3.9
+"""
+Reads the mumble link once and pushes every new frame to any number of local
+subscribers (see LinkSubscriber), so helper tools don't each have to poll the
+link themselves. Every frame is also appended to the shared LinkHistory.
+
+Subscribers that fall behind never block the hub or each other: a frame that
+cannot be sent right away replaces any older frame still waiting for that
+subscriber, so a slow subscriber only ever skips to the latest frame.
+"""
+import argparse
+import os
+import selectors
+import socket
+import sys
+from typing import Optional
+
+from mumble_link import MumbleLink, LinkNotifier, HUB_SOCKET_PATH, HUB_FRAME_HEADER
+from link_recorder import LinkReplay
+from link_history import LinkHistory, HISTORY_PATH
+
+
+POLL_INTERVAL = 1/60
+
+
+class Subscriber:
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+        # The message currently being sent, and the latest one waiting behind it
+        self.sending: Optional[memoryview] = None
+        self.waiting: Optional[bytes] = None
+        self.dropped = 0
+
+    def fileno(self) -> int:
+        return self.connection.fileno()
+
+    def push(self, message: bytes) -> bool:
+        """
+        @return True if everything queued for this subscriber has been sent
+        """
+        if self.sending is None:
+            self.sending = memoryview(message)
+        else:
+            if self.waiting is not None:
+                self.dropped += 1
+            self.waiting = message
+        return self.flush()
+
+    def flush(self) -> bool:
+        """
+        @return True if everything queued for this subscriber has been sent
+        """
+        while self.sending is not None:
+            try:
+                sent = self.connection.send(self.sending)
+            except BlockingIOError:
+                return False
+            self.sending = self.sending[sent:]
+            if not self.sending:
+                self.sending = memoryview(self.waiting) if self.waiting is not None else None
+                self.waiting = None
+        return True
+
+
+class LinkHub:
+    def __init__(self, link: MumbleLink, path: str = HUB_SOCKET_PATH, notify: bool = True,
+                 history: Optional[LinkHistory] = None):
+        self.link = link
+        self.path = path
+        self.history = history
+        self.selector = selectors.DefaultSelector()
+        self.subscribers = {}
+
+        # A stale socket file is left behind if a previous hub was killed
+        if os.path.exists(path):
+            os.unlink(path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen()
+        self.listener.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ, self.accept)
+
+        self.notifier = None
+        if notify:
+            try:
+                self.notifier = LinkNotifier()
+            except OSError as e:
+                print("Link notifications unavailable, polling instead:", e)
+        if self.notifier is not None:
+            self.selector.register(self.notifier, selectors.EVENT_READ, self.on_notified)
+
+    def close(self):
+        for subscriber in list(self.subscribers.values()):
+            self.disconnect(subscriber)
+        self.selector.close()
+        self.listener.close()
+        if self.notifier is not None:
+            self.notifier.close()
+        os.unlink(self.path)
+
+    def accept(self):
+        connection, _ = self.listener.accept()
+        connection.setblocking(False)
+        subscriber = Subscriber(connection)
+        self.subscribers[connection.fileno()] = subscriber
+        self.selector.register(connection, selectors.EVENT_READ, self.on_subscriber_event)
+        print("Subscriber connected ({} total)".format(len(self.subscribers)))
+        # Start new subscribers off with the current frame
+        self.send(subscriber, self.message())
+
+    def disconnect(self, subscriber: Subscriber):
+        self.selector.unregister(subscriber.connection)
+        del self.subscribers[subscriber.fileno()]
+        subscriber.connection.close()
+        print("Subscriber disconnected after dropping {} frames ({} left)".format(
+            subscriber.dropped, len(self.subscribers)
+        ))
+
+    def send(self, subscriber: Subscriber, message: bytes):
+        try:
+            done = subscriber.push(message)
+        except OSError:
+            self.disconnect(subscriber)
+            return
+        self.watch(subscriber, done)
+
+    def watch(self, subscriber: Subscriber, done: bool):
+        events = selectors.EVENT_READ
+        if not done:
+            events |= selectors.EVENT_WRITE
+        self.selector.modify(subscriber.connection, events, self.on_subscriber_event)
+
+    def on_subscriber_event(self, connection: socket.socket, events: int):
+        # The subscriber may have been dropped earlier in the same batch of
+        # events, and its fd even reused by a newly accepted one
+        subscriber = self.subscribers.get(connection.fileno())
+        if subscriber is None or subscriber.connection is not connection:
+            return
+        if events & selectors.EVENT_READ:
+            # Subscribers never send anything, so readable means closed
+            try:
+                data = subscriber.connection.recv(1)
+            except OSError:
+                data = b""
+            if not data:
+                self.disconnect(subscriber)
+                return
+        if events & selectors.EVENT_WRITE:
+            try:
+                done = subscriber.flush()
+            except OSError:
+                self.disconnect(subscriber)
+                return
+            self.watch(subscriber, done)
+
+    def on_notified(self):
+        self.notifier.drain()
+        self.publish()
+
+    def message(self) -> bytes:
+        source = self.link.source
+        header = HUB_FRAME_HEADER.pack(
+            source.sequence or 0, self.link.tick_rate, self.link.tick_jitter, self.link.timestamp
+        )
+        return header + bytes(self.link.buffer)
+
+    def publish(self):
+        if not self.link.update():
+            return
+        if self.history is not None:
+            self.history.append(self.link.snapshot, self.link.timestamp)
+        message = self.message()
+        for subscriber in list(self.subscribers.values()):
+            self.send(subscriber, message)
+
+    def run(self):
+        timeout = None if self.notifier is not None else POLL_INTERVAL
+        while True:
+            for key, events in self.selector.select(timeout):
+                if key.fileobj is self.listener or key.fileobj is self.notifier:
+                    key.data()
+                else:
+                    key.data(key.fileobj, events)
+            if self.notifier is None:
+                self.publish()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish mumble link frames to local subscribers")
+    parser.add_argument("--socket", default=HUB_SOCKET_PATH, help="path of the unix socket to listen on")
+    parser.add_argument("--replay", metavar="PATH", help="publish a link recording instead of the live game")
+    parser.add_argument("--history", default=HISTORY_PATH, help="shared memory file for the frame history")
+    parser.add_argument("--no-history", action="store_true", help="don't keep a frame history")
+    args = parser.parse_args()
+
+    if args.replay:
+        link = MumbleLink(LinkReplay(args.replay, loop=True))
+    else:
+        link = MumbleLink()
+
+    history = None if args.no_history else LinkHistory(args.history)
+    hub = LinkHub(link, args.socket, notify=not args.replay, history=history)
+    print("Publishing mumble link frames on", args.socket)
+    try:
+        hub.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        hub.close()
+        link.close()
+        if history is not None:
+            history.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
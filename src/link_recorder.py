@@ -0,0 +1,232 @@
+#!/usr/bin/env python3.9
+"""
+Records mumble link frames to a compact log and replays them, so the overlay
+and the geometry code can be run and profiled without the game.
+
+A recording starts with a header (magic, version, frame size) followed by one
+record per frame: a timestamp, the number of changed byte runs, and then each
+run as an offset, a length and the new bytes. Runs are relative to the
+previous frame (the first frame is relative to a zeroed page), so a frame in
+which only the tick and the positions changed costs a few dozen bytes.
+"""
+import argparse
+import select
+import struct
+import sys
+import time
+import numpy as np
+from typing import BinaryIO, Iterator, List, Tuple
+
+from mumble_link import PAGE_SIZE, open_live_link
+
+
+MAGIC = b"FLANLINK"
+VERSION = 1
+FILE_HEADER = struct.Struct("<8sII")
+RECORD_HEADER = struct.Struct("<dH")
+RUN_HEADER = struct.Struct("<HH")
+# Unchanged gaps shorter than a run header are cheaper to store than to skip
+MERGE_GAP = RUN_HEADER.size
+POLL_INTERVAL = 1/60
+
+
+def changed_runs(previous: bytes, current: bytes) -> List[Tuple[int, int]]:
+    """
+    @return (start, stop) byte ranges in which current differs from previous
+    """
+    changed = np.flatnonzero(np.frombuffer(current, np.uint8) != np.frombuffer(previous, np.uint8))
+    if not changed.size:
+        return []
+    breaks = np.flatnonzero(np.diff(changed) > MERGE_GAP)
+    starts = np.concatenate((changed[:1], changed[breaks + 1]))
+    stops = np.concatenate((changed[breaks], changed[-1:])) + 1
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+class LinkRecorder:
+    def __init__(self, out_file: BinaryIO):
+        self.out_file = out_file
+        self.previous = bytes(PAGE_SIZE)
+        self.frame_count = 0
+        self.out_file.write(FILE_HEADER.pack(MAGIC, VERSION, PAGE_SIZE))
+
+    def record(self, frame: bytes, timestamp: float) -> None:
+        frame = bytes(frame)
+        runs = changed_runs(self.previous, frame)
+        parts = [RECORD_HEADER.pack(timestamp, len(runs))]
+        for start, stop in runs:
+            parts.append(RUN_HEADER.pack(start, stop - start))
+            parts.append(frame[start:stop])
+        self.out_file.write(b"".join(parts))
+        self.previous = frame
+        self.frame_count += 1
+
+
+def read_records(in_file: BinaryIO) -> Iterator[Tuple[float, bytes]]:
+    """
+    @return Iterator of (timestamp, frame) pairs, where each frame is a full page.
+    A last record cut short, as left by a recorder that was killed, ends the
+    recording early.
+    """
+    header = in_file.read(FILE_HEADER.size)
+    if len(header) < FILE_HEADER.size:
+        raise ValueError("not a mumble link recording")
+    magic, version, frame_size = FILE_HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION or frame_size != PAGE_SIZE:
+        raise ValueError("not a mumble link recording")
+
+    frame = bytearray(PAGE_SIZE)
+    while True:
+        header = in_file.read(RECORD_HEADER.size)
+        if not header:
+            return
+        if len(header) < RECORD_HEADER.size:
+            print("Recording ends in a truncated record, ignoring it")
+            return
+        timestamp, run_count = RECORD_HEADER.unpack(header)
+        for _ in range(run_count):
+            run_header = in_file.read(RUN_HEADER.size)
+            if len(run_header) < RUN_HEADER.size:
+                print("Recording ends in a truncated record, ignoring it")
+                return
+            offset, length = RUN_HEADER.unpack(run_header)
+            if offset + length > PAGE_SIZE:
+                raise ValueError("corrupt mumble link recording: run past the end of the frame")
+            data = in_file.read(length)
+            if len(data) < length:
+                print("Recording ends in a truncated record, ignoring it")
+                return
+            frame[offset:offset+length] = data
+        yield timestamp, bytes(frame)
+
+
+class LinkReplay:
+    """
+    A MumbleLink source that plays back a recording. In real time mode each
+    read advances to the latest frame whose timestamp has been reached; with
+    realtime=False every read advances exactly one frame, for benchmarks.
+    """
+
+    def __init__(self, path: str, realtime: bool = True, loop: bool = False):
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.in_file = open(path, "rb")
+        self.records = read_records(self.in_file)
+        self.pending = None
+        self.start_time = None
+        self.first_timestamp = None
+        self.sequence = 0
+        self.tick_rate = 0.0
+        self.tick_jitter = 0.0
+        # Recorded timestamps are shifted so the replay appears to be live
+        self.timestamp = 0.0
+        self.time_offset = None
+
+    def close(self):
+        self.in_file.close()
+
+    def rewind(self):
+        self.in_file.seek(0)
+        self.records = read_records(self.in_file)
+        self.pending = None
+        self.start_time = None
+        self.time_offset = None
+
+    def next_record(self):
+        if self.pending is not None:
+            record, self.pending = self.pending, None
+            return record
+        record = next(self.records, None)
+        if record is None and self.loop:
+            self.rewind()
+            record = next(self.records, None)
+        return record
+
+    def read_into(self, buffer: bytearray) -> bool:
+        record = self.next_record()
+        if record is None:
+            return False
+        if self.time_offset is None:
+            self.time_offset = time.time() - record[0]
+        if not self.realtime:
+            buffer[:] = record[1]
+            self.sequence += 1
+            self.timestamp = record[0] + self.time_offset
+            return True
+
+        if self.start_time is None:
+            self.start_time = time.monotonic()
+            self.first_timestamp = record[0]
+        elapsed = time.monotonic() - self.start_time
+        latest = None
+        while record is not None and record[0] - self.first_timestamp <= elapsed:
+            latest = record
+            record = next(self.records, None)
+        self.pending = record
+        if latest is None:
+            return False
+        buffer[:] = latest[1]
+        self.sequence += 1
+        self.timestamp = latest[0] + self.time_offset
+        return True
+
+
+def record(path: str) -> None:
+    link, notifier = open_live_link()
+    with open(path, "wb") as out_file:
+        recorder = LinkRecorder(out_file)
+        print("Recording to", path, "(Ctrl+C to stop)")
+        try:
+            while True:
+                if notifier is not None:
+                    select.select([notifier], [], [])
+                else:
+                    time.sleep(POLL_INTERVAL)
+                try:
+                    if notifier is not None:
+                        notifier.drain()
+                    updated = link.update()
+                except ConnectionError as e:
+                    # Keep recording the same frames straight from the link
+                    print("Lost the link hub, reading the link directly:", e)
+                    link.close()
+                    link, notifier = open_live_link(use_hub=False)
+                    updated = link.update()
+                if updated:
+                    recorder.record(link.buffer, link.timestamp)
+        except KeyboardInterrupt:
+            pass
+    print("Recorded {} frames".format(recorder.frame_count))
+
+
+def info(path: str) -> None:
+    frame_count = 0
+    first_timestamp = last_timestamp = 0.0
+    with open(path, "rb") as in_file:
+        for timestamp, _ in read_records(in_file):
+            if frame_count == 0:
+                first_timestamp = timestamp
+            last_timestamp = timestamp
+            frame_count += 1
+        size = in_file.tell()
+    print("{} frames over {:.1f}s, {} bytes ({:.1f} bytes/frame)".format(
+        frame_count, last_timestamp - first_timestamp, size, size / max(frame_count, 1)
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and inspect mumble link recordings")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("record", help="record frames until interrupted").add_argument("path")
+    subparsers.add_parser("info", help="summarize a recording").add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.path)
+    elif args.command == "info":
+        info(args.path)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
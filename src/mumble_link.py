@@ -1,11 +1,31 @@
 import json
+import mmap
 import os
+import socket
 import struct
+import time
 import numpy as np
 from enum import Enum, Flag
 from dataclasses import dataclass
+from typing import NamedTuple
 
 MUMBLE_LINK_FILE = "/tmp/gw2_mumble_link"
+PAGE_SIZE = 4096
+# Layout of the file written by converter.py: a header holding a seqlock
+# sequence counter, the converter's measured tick rate and jitter and the
+# time the frame was published, followed by a copy of the MumbleLink page
+HEADER_SIZE = 32
+SEQUENCE = struct.Struct("<I")
+FRAME_INFO = struct.Struct("<ffd")
+FRAME_INFO_OFFSET = 8
+LINK_FILE_SIZE = HEADER_SIZE + PAGE_SIZE
+MAX_READ_ATTEMPTS = 100
+NOTIFY_ADDRESS = ("127.0.0.1", 47320)
+# link_hub.py republishes every frame to subscribers of this socket as a
+# fixed size message: the frame header below followed by the page
+HUB_SOCKET_PATH = "/tmp/gw2_mumble_link.sock"
+HUB_FRAME_HEADER = struct.Struct("<Iffd")
+HUB_MESSAGE_SIZE = HUB_FRAME_HEADER.size + PAGE_SIZE
 
 
 class Mount(Enum):
@@ -58,7 +78,7 @@ class UIState(Flag):
     IN_COMBAT = 64
 
 
-@dataclass
+@dataclass(frozen=True)
 class Identity:
     name: str
     profession: Profession
@@ -72,6 +92,216 @@ class Identity:
     ui_size: UISize
 
 
+# Every scalar field of the MumbleLink page in one precompiled struct. The
+# vector fields are padding here and are read as two float arrays instead.
+LINK_LAYOUT = struct.Struct("<II36x512s36x512s32xIIIIIIHHffffffIB")
+AVATAR_VECTORS_OFFSET = 8
+CAMERA_VECTORS_OFFSET = 556
+
+
+def _vectors(buffer, offset: int) -> np.ndarray:
+    vectors = np.frombuffer(buffer, dtype='<f4', count=9, offset=offset).reshape(3, 3).astype(float)
+    vectors.flags.writeable = False
+    return vectors
+
+
+class LinkSnapshot(NamedTuple):
+    """
+    Every field of one MumbleLink frame, decoded in a single pass. Strings are
+    kept as the raw UTF-16 bytes, since they are rarely needed and decoding
+    them is comparatively expensive.
+    """
+    ui_version: int
+    ui_tick: int
+    avatar_position: np.ndarray
+    avatar_front: np.ndarray
+    avatar_top: np.ndarray
+    name_raw: bytes
+    camera_position: np.ndarray
+    camera_front: np.ndarray
+    camera_top: np.ndarray
+    identity_raw: bytes
+    map_id: int
+    map_type: int
+    shard_id: int
+    instance: int
+    build_id: int
+    ui_state: int
+    compass_width: int
+    compass_height: int
+    compass_rotation: float
+    player_x: float
+    player_y: float
+    map_center_x: float
+    map_center_y: float
+    map_scale: float
+    process_id: int
+    mount_index: int
+
+    @classmethod
+    def decode(cls, buffer) -> 'LinkSnapshot':
+        (
+            ui_version, ui_tick, name_raw, identity_raw,
+            *context
+        ) = LINK_LAYOUT.unpack_from(buffer)
+        avatar = _vectors(buffer, AVATAR_VECTORS_OFFSET)
+        camera = _vectors(buffer, CAMERA_VECTORS_OFFSET)
+        return cls(
+            ui_version, ui_tick, avatar[0], avatar[1], avatar[2], name_raw,
+            camera[0], camera[1], camera[2], identity_raw, *context
+        )
+
+
+class LinkNotifier:
+    """
+    Receives the datagram converter.py sends after publishing each frame.
+    The socket becomes readable whenever a new frame is available, so it can
+    be handed to select() or a QSocketNotifier instead of polling the link.
+    """
+
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        try:
+            self.socket.bind(NOTIFY_ADDRESS)
+        except OSError:
+            self.socket.close()
+            raise
+
+    def fileno(self) -> int:
+        return self.socket.fileno()
+
+    def close(self):
+        self.socket.close()
+
+    def drain(self) -> int:
+        """
+        @return Number of notifications that were pending
+        """
+        count = 0
+        while True:
+            try:
+                self.socket.recv(64)
+            except BlockingIOError:
+                return count
+            count += 1
+
+
+class MappedLinkSource:
+    """
+    Reads frames out of the file converter.py publishes them to. Sources
+    copy each new complete frame into the buffer MumbleLink hands them and
+    report whether they did.
+    """
+
+    def __init__(self, path: str = MUMBLE_LINK_FILE):
+        # The converter writes into its own mapping of this file, so mapping
+        # it here shares the same pages and reads never need a syscall. Only
+        # reading is needed, unless the overlay starts before the converter
+        # has created the file, in which case it is created and sized here.
+        try:
+            self.fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(self.fd).st_size < LINK_FILE_SIZE:
+                os.ftruncate(self.fd, LINK_FILE_SIZE)
+        self.map = mmap.mmap(self.fd, LINK_FILE_SIZE, access=mmap.ACCESS_READ)
+        self.frame_view = memoryview(self.map)[HEADER_SIZE:]
+        self.sequence = None
+        # Game ticks per second and tick jitter in seconds as measured by
+        # the converter's scheduler, and the time.time() the latest frame was
+        # published at
+        self.tick_rate = 0.0
+        self.tick_jitter = 0.0
+        self.timestamp = 0.0
+
+    def close(self):
+        self.frame_view.release()
+        self.map.close()
+        os.close(self.fd)
+
+    def read_into(self, buffer: bytearray) -> bool:
+        """
+        @return True if a new complete frame was copied into buffer, False if
+        the link is unchanged or the converter kept writing for every attempt
+        """
+        for _ in range(MAX_READ_ATTEMPTS):
+            sequence = SEQUENCE.unpack_from(self.map, 0)[0]
+            if sequence == self.sequence:
+                return False
+            # An odd sequence means the converter is in the middle of a copy
+            if sequence & 1:
+                continue
+            buffer[:] = self.frame_view
+            info = FRAME_INFO.unpack_from(self.map, FRAME_INFO_OFFSET)
+            if SEQUENCE.unpack_from(self.map, 0)[0] == sequence:
+                self.sequence = sequence
+                self.tick_rate, self.tick_jitter, self.timestamp = info
+                # Converters from before the header had a timestamp leave it zeroed
+                if not self.timestamp:
+                    self.timestamp = time.time()
+                return True
+        return False
+
+
+class LinkSubscriber:
+    """
+    A MumbleLink source that receives frames pushed by link_hub.py. Like
+    LinkNotifier, its socket becomes readable when a new frame arrives. When
+    frames arrive faster than they are read only the latest one is kept.
+    """
+
+    def __init__(self, path: str = HUB_SOCKET_PATH):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(path)
+        except OSError:
+            self.socket.close()
+            raise
+        self.socket.setblocking(False)
+        self.received = bytearray()
+        self.latest = None
+        self.sequence = None
+        self.tick_rate = 0.0
+        self.tick_jitter = 0.0
+        self.timestamp = 0.0
+
+    def fileno(self) -> int:
+        return self.socket.fileno()
+
+    def close(self):
+        self.socket.close()
+
+    def drain(self) -> int:
+        """
+        @return Number of frames that were pending
+        """
+        while True:
+            try:
+                data = self.socket.recv(HUB_MESSAGE_SIZE * 4)
+            except BlockingIOError:
+                break
+            if not data:
+                raise ConnectionError("the link hub closed the connection")
+            self.received += data
+
+        count = len(self.received) // HUB_MESSAGE_SIZE
+        if count:
+            end = count * HUB_MESSAGE_SIZE
+            self.latest = bytes(self.received[end - HUB_MESSAGE_SIZE:end])
+            del self.received[:end]
+        return count
+
+    def read_into(self, buffer: bytearray) -> bool:
+        self.drain()
+        if self.latest is None:
+            return False
+        self.sequence, self.tick_rate, self.tick_jitter, self.timestamp = HUB_FRAME_HEADER.unpack_from(self.latest)
+        buffer[:] = memoryview(self.latest)[HUB_FRAME_HEADER.size:]
+        self.latest = None
+        return True
+
+
 class MumbleLink:
     PROPERTIES = (
         'ui_version', 'ui_tick', 'avatar_position', 'avatar_front',
@@ -83,17 +313,59 @@ class MumbleLink:
         'process_id', 'mount'
     )
 
-    def __init__(self):
-        self.fd = os.open(MUMBLE_LINK_FILE, os.O_RDONLY)
-        self.buffer = bytearray(4096)
+    def __init__(self, source=None):
+        """
+        @param source where frames come from, the converter's file by default
+        """
+        if source is None:
+            source = MappedLinkSource()
+        self.source = source
+        # Frames are copied into the back buffer and only swapped in once the
+        # copy is known to be consistent, so a torn read never reaches buffer
+        self.buffer = bytearray(PAGE_SIZE)
+        self.back_buffer = bytearray(PAGE_SIZE)
+        self.snapshot = LinkSnapshot.decode(self.buffer)
+        # Decoded strings, cached until the raw bytes they came from change
+        self._name_key = None
+        self._name = None
+        self._identity_key = None
+        self._identity_raw = None
+        self._identity = None
         self.update()
 
     def close(self):
-        os.close(self.fd)
+        self.source.close()
+
+    def update(self) -> bool:
+        """
+        @return True if a new complete frame was read
+        """
+        if not self.source.read_into(self.back_buffer):
+            return False
+        self.buffer, self.back_buffer = self.back_buffer, self.buffer
+        self.snapshot = LinkSnapshot.decode(self.buffer)
+        return True
+
+    @property
+    def tick_rate(self) -> float:
+        """
+        @return Game ticks per second as measured by the converter
+        """
+        return self.source.tick_rate
+
+    @property
+    def tick_jitter(self) -> float:
+        """
+        @return Tick jitter in seconds as measured by the converter
+        """
+        return self.source.tick_jitter
 
-    def update(self):
-        os.lseek(self.fd, 0, os.SEEK_SET)
-        os.readv(self.fd, [self.buffer])
+    @property
+    def timestamp(self) -> float:
+        """
+        @return time.time() at which the current frame was published
+        """
+        return self.source.timestamp
 
     def parse(self, fmt: str, offset: int):
         return struct.unpack_from(fmt, self.buffer, offset)[0]
@@ -108,43 +380,58 @@ class MumbleLink:
 
     @property
     def ui_version(self):
-        return self.parse("I", 0)
+        return self.snapshot.ui_version
 
     @property
     def ui_tick(self):
-        return self.parse("I", 4)
+        return self.snapshot.ui_tick
 
     @property
     def avatar_position(self):
-        return np.array(self.unpack("3f", 8))
+        return self.snapshot.avatar_position
 
     @property
     def avatar_front(self):
-        return np.array(self.unpack("3f", 20))
+        return self.snapshot.avatar_front
 
     @property
     def avatar_top(self):
-        return np.array(self.unpack("3f", 32))
+        return self.snapshot.avatar_top
 
     @property
     def name(self):
-        return self.parse("512s", 44).decode('utf-16').split('\0')[0]
+        raw = self.snapshot.name_raw
+        if raw != self._name_key:
+            self._name_key = raw
+            self._name = raw.decode('utf-16').split('\0')[0]
+        return self._name
 
     @property
     def camera_position(self):
-        return np.array(self.unpack("3f", 556))
+        return self.snapshot.camera_position
 
     @property
     def camera_front(self):
-        return np.array(self.unpack("3f", 568))
+        return self.snapshot.camera_front
 
     @property
     def camera_top(self):
-        return np.array(self.unpack("3f", 580))
+        return self.snapshot.camera_top
 
     @property
     def identity_raw(self):
-        json_string = self.parse("512s", 592).decode('utf-16').split('\0')[0]
+        raw = self.snapshot.identity_raw
+        # The identity only changes on map loads and the like, so only decode
+        # and parse it when its bytes differ from the previous frame's
+        if raw != self._identity_key:
+            self._identity_key = raw
+            self._identity_raw = self.parse_identity(raw)
+            self._identity = None
+        return self._identity_raw
+
+    @staticmethod
+    def parse_identity(raw: bytes) -> dict:
+        json_string = raw.decode('utf-16').split('\0')[0]
         if json_string:
             try:
                 return json.loads(json_string)
@@ -156,104 +443,128 @@ class MumbleLink:
     @property
     def identity(self):
         r = self.identity_raw
-        return Identity(
-            r.get("name", ""),
-            Profession(r.get("profession", 0)),
-            r.get("spec", 0),
-            Race(r.get("race", 0)),
-            r.get("map_id", 0),
-            r.get("world_id", 0),
-            r.get("team_color_id", 0),
-            r.get("commander", False),
-            r.get("fov", 0.0),
-            UISize(r.get("uisz", 0))
-        )
+        if self._identity is None:
+            self._identity = Identity(
+                r.get("name", ""),
+                Profession(r.get("profession", 0)),
+                r.get("spec", 0),
+                Race(r.get("race", 0)),
+                r.get("map_id", 0),
+                r.get("world_id", 0),
+                r.get("team_color_id", 0),
+                r.get("commander", False),
+                r.get("fov", 0.0),
+                UISize(r.get("uisz", 0))
+            )
+        return self._identity
 
     @property
     def map_id(self):
-        return self.parse("I", 1136)
+        return self.snapshot.map_id
 
     @property
     def map_type(self):
-        return self.parse("I", 1140)
+        return self.snapshot.map_type
 
     @property
     def shard_id(self):
-        return self.parse("I", 1144)
+        return self.snapshot.shard_id
 
     @property
     def instance(self):
-        return self.parse("I", 1148)
+        return self.snapshot.instance
 
     @property
     def build_id(self):
-        return self.parse("I", 1152)
+        return self.snapshot.build_id
 
     @property
     def ui_state(self):
-        return UIState(self.parse("I", 1156))
+        return UIState(self.snapshot.ui_state)
 
     @property
     def compass_width(self):
         """
         @return Compass width in pixels
         """
-        return self.parse("H", 1160)
+        return self.snapshot.compass_width
 
     @property
     def compass_height(self):
         """
         @return Compass height in pixels
         """
-        return self.parse("H", 1162)
+        return self.snapshot.compass_height
 
     @property
     def compass_rotation(self):
         """
         @return Compass rotation in radians
         """
-        return self.parse("f", 1164)
+        return self.snapshot.compass_rotation
 
     @property
     def player_x(self):
         """
         @return Player x coordinate in continentCoords
         """
-        return self.parse("f", 1168)
+        return self.snapshot.player_x
 
     @property
     def player_y(self):
         """
         @return Player y coordinate in continentCoords
         """
-        return self.parse("f", 1172)
+        return self.snapshot.player_y
 
     @property
     def map_center_x(self):
         """
         @return Map center x coordinate in continentCoords
         """
-        return self.parse("f", 1176)
+        return self.snapshot.map_center_x
 
     @property
     def map_center_y(self):
         """
         @return Map center x coordinate in continentCoords
         """
-        return self.parse("f", 1180)
+        return self.snapshot.map_center_y
 
     @property
     def map_scale(self):
-        return self.parse("f", 1184)
+        return self.snapshot.map_scale
 
     @property
     def process_id(self):
-        return self.parse("I", 1188)
+        return self.snapshot.process_id
 
     @property
     def mount_index(self):
-        return self.parse("B", 1192)
+        return self.snapshot.mount_index
 
     @property
     def mount(self):
         return Mount(self.mount_index)
+
+
+def open_live_link(use_hub: bool = True):
+    """
+    @return the link and the notifier announcing its frames (None to poll),
+    preferring frames pushed by a running link_hub.py
+    """
+    if use_hub:
+        try:
+            subscriber = LinkSubscriber()
+        except OSError:
+            pass
+        else:
+            print("Subscribed to the link hub")
+            return MumbleLink(subscriber), subscriber
+
+    live_link = MumbleLink()
+    try:
+        return live_link, LinkNotifier()
+    except OSError as e:
+        print("Link notifications unavailable, polling instead:", e)
+        return live_link, None
@@ -1,22 +1,39 @@
 #!/usr/bin/env python3.9
+import startup
+import argparse
+import select
+import signal
 import sys
-import numpy as np
-from scipy.spatial.transform import Rotation
-from geometry import Vector2, Vector3, TransformMatrix
-
-from mumble_link import MumbleLink
-from gw2_api import GW2API
-
-from PyQt5 import QtGui, QtCore
-from PyQt5 import QtWidgets
-from PyQt5.QtWidgets import QMainWindow, QApplication
-
+import threading
 import time
-
-link = MumbleLink()
-api = GW2API()
-
-print(link)
+from typing import Optional, Tuple
+
+with startup.timer.stage("import numpy"):
+    import numpy as np
+with startup.timer.stage("import geometry"):
+    from geometry import Vector2, Vector3, Vector3Array, TransformMatrix, SpatialGrid
+
+# PyQt5 first, since the scene modules import parts of it too and would
+# otherwise have its import time counted against them
+with startup.timer.stage("import PyQt5"):
+    from PyQt5 import QtGui, QtCore
+    from PyQt5 import QtWidgets
+    from PyQt5.QtWidgets import QMainWindow, QApplication
+
+with startup.timer.stage("import link modules"):
+    from mumble_link import MumbleLink, open_live_link
+    from link_recorder import LinkReplay
+    from link_history import LinkHistory
+    from pose_predictor import PosePredictor, HISTORY_FRAMES
+    from frame_pacer import FramePacer, PacingMode
+    from frame_stats import FrameStats
+with startup.timer.stage("import scene"):
+    from scene import Scene, SceneFrame, damage, LineNode, LabelNode, ScreenLabelNode
+with startup.timer.stage("import gw2_api"):
+    from gw2_api import GW2API
+
+link = None
+api = None
 
 # Pos 1 =               (-57.73, 24.00, 158.40)
 # Moving to the east =  (-42.92, 24.00, 158.43)
@@ -135,7 +152,19 @@ int main(...)
 
 """
 
+# Milliseconds between returns to Python from Qt's event loop, which is when
+# signal handlers get to run
+SIGNAL_CHECK_INTERVAL = 200
+
+# Distance in front of the near plane segments are clipped to, which keeps
+# the perspective divide away from zero
+CLIP_EPSILON = 1e-6
+
+
 class Camera:
+    # The most recently built camera and the parameters it was built from
+    _cache = None
+
     def __init__(self, location: Vector3, focus: Vector3, screenShape: Vector2, fov: float):
         """
         @param location an (x, y, z) tuple where x is west <-> east, y is down <-> up, and z is south <-> north
@@ -143,6 +172,7 @@ class Camera:
         """
         # Width and height of the screen
         self.screenShape = screenShape
+        self.location = location
 
         # Create transform matrices (TACO method)
         focus = focus.normalize()
@@ -155,14 +185,9 @@ class Camera:
         self.camera_to_world[3, :3] = location._np_arr
         # ???
         self.camera_to_world = self.camera_to_world.transpose()
-        print("CameraToWorld transform:", self.camera_to_world, sep='\n')
-
-        self.world_to_camera = self.camera_to_world.inverse()
-        print("WorldToCamera transform:", self.world_to_camera, sep='\n')
+        self.world_to_camera = self.camera_to_world.rigid_inverse()
 
         aspect = self.screenShape.x / self.screenShape.y
-        print("Aspect:", aspect)
-        print("FOV:", link.identity.fov)
         zn = 0.01
         zf = 150.0
         self.perspective_transform = TransformMatrix.identity()
@@ -175,162 +200,341 @@ class Camera:
         # ???
         self.perspective_transform = self.perspective_transform.transpose()
         #self.perspective_transform = self.perspective_transform.inverse()
-        print("Taco Persp Transform:", self.perspective_transform, sep='\n')
 
-    def worldToScreenPoint(self, point: Vector3) -> Vector2:
+        self.view_projection = self.perspective_transform._np_arr @ self.world_to_camera._np_arr
+
+        # Size of the visible region after the perspective divide
         width = self.screenShape.x
         height = self.screenShape.y
-        width_percent = width / (width + height)
-        height_percent = height / (width + height)
         # ???
         magic = 5
-        canvas_width = width_percent * magic
-        canvas_height = height_percent * magic
-
-        # Convert from world to camera space
-        cameraPoint = point
-        # ???
-        #cameraPoint = self.perspective_transform.apply(cameraPoint)
-        cameraPoint = self.world_to_camera.apply(cameraPoint)
-        cameraPoint = self.perspective_transform.apply(cameraPoint)
-
-        # Convert from camera space to screen coordinates
-        screenPoint = Vector2()
-        # ???
-        #screenPoint.x = (cameraPoint.x / -cameraPoint.z)
-        #screenPoint.y = (cameraPoint.y / -cameraPoint.z)
-        screenPoint.x = (cameraPoint.x / cameraPoint.z)
-        screenPoint.y = (cameraPoint.y / cameraPoint.z)
-
-        print("ScreenPoint Pre-normal:", screenPoint)
-
-        # Check if the point is visible
-        if abs(screenPoint.x) > canvas_width or abs(screenPoint.y) > canvas_height:
-            return None
-
-        # Normalize
-        normalizedPoint = Vector2()
-        normalizedPoint.x = (screenPoint.x + (canvas_width / 2)) / canvas_width
-        normalizedPoint.y = (screenPoint.y + (canvas_height / 2)) / canvas_height
-
-        print("Normalized ScreenPoint:", normalizedPoint)
-
-        # Convert to pixel coordinates
-        result = Vector2(dtype=int)
-        result.x = np.floor(normalizedPoint.x * self.screenShape.x)
-        result.y = np.floor((1 - normalizedPoint.y) * self.screenShape.y)
-        return result
-
-    def screenToWorldPoint(self, position: Vector2, z: float) -> Vector3:
-        pass
-
+        self.canvas_width = width / (width + height) * magic
+        self.canvas_height = height / (width + height) * magic
+        self.canvas_shape = np.array([self.canvas_width, self.canvas_height])
+
+        # Planes bounding what worldToScreenPoints shows, in clip space, as
+        # (a, b, c, d) with the inside where a*x + b*y + c*z + d*w >= 0. The
+        # divide is by clip z, which is positive in front of the near plane.
+        self.clip_planes = np.array([
+            (0, 0, 1, -CLIP_EPSILON),
+            (-1, 0, self.canvas_width, 0),
+            (1, 0, self.canvas_width, 0),
+            (0, -1, self.canvas_height, 0),
+            (0, 1, self.canvas_height, 0),
+        ])
+        # The same planes in world space
+        self.frustum_planes = self.clip_planes @ self.view_projection
+
+    @classmethod
+    def clear_cache(cls) -> None:
+        """
+        Forgets the cached camera, so the next cached() call builds a new one
+        """
+        cls._cache = None
 
-def vertices_around(point: Vector3):
-    bottom = np.array(point._np_arr)
-    top = np.array(point._np_arr)
-    top[1] += 2
-
-    bottom_northwest = Vector3(np.array(bottom))
-    bottom_northwest[2] += 2
-    bottom_northwest[0] -= 2
-
-    bottom_northeast = Vector3(np.array(bottom))
-    bottom_northeast[2] += 2
-    bottom_northeast[0] += 2
-
-    bottom_southeast = Vector3(np.array(bottom))
-    bottom_southeast[2] -= 2
-    bottom_southeast[0] += 2
-
-    bottom_southwest = Vector3(np.array(bottom))
-    bottom_southwest[2] -= 2
-    bottom_southwest[0] -= 2
-
-    top_northwest = Vector3(np.array(top))
-    top_northwest[2] += 2
-    top_northwest[0] -= 2
-
-    top_northeast = Vector3(np.array(top))
-    top_northeast[2] += 2
-    top_northeast[0] += 2
-
-    top_southeast = Vector3(np.array(top))
-    top_southeast[2] -= 2
-    top_southeast[0] += 2
-
-    top_southwest = Vector3(np.array(top))
-    top_southwest[2] -= 2
-    top_southwest[0] -= 2
-
-    return {
-        '+SW': top_southwest,
-        '+NW': top_northwest,
-        '+SE': top_southeast,
-        '+NE': top_northeast,
-        '-SW': bottom_southwest,
-        '-NW': bottom_northwest,
-        '-SE': bottom_southeast,
-        '-NE': bottom_northeast,
-    }
+    @classmethod
+    def cached(cls, location: Vector3, focus: Vector3, screenShape: Vector2, fov: float) -> 'Camera':
+        """
+        @return a Camera for these parameters, reusing the previous one if
+        they are unchanged (standing still, menus open)
+        """
+        key = (location._np_arr.tobytes(), focus._np_arr.tobytes(), screenShape._np_arr.tobytes(), fov)
+        if cls._cache is None or cls._cache[0] != key:
+            cls._cache = (key, cls(location, focus, screenShape, fov))
+        return cls._cache[1]
 
+    def worldToScreenPoints(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        @param points (N, 3) array of world positions
+        @return (N, 2) array of integer pixel coordinates and an (N,) mask of
+        the points that are on screen, pixels of hidden points are 0
+        """
+        # Both transforms leave w at 1 for world points, so applying them in
+        # turn is one multiply by their product
+        clip = points @ self.view_projection[:, :3].T + self.view_projection[:, 3]
 
-def wireframe_around(point: Vector3):
-    bottom = np.array(point._np_arr)
-    top = np.array(point._np_arr)
-    top[1] += 2
+        # Inside every clip plane, the near one included: behind the camera
+        # both divided coordinates flip sign, and would otherwise pass the
+        # side planes mirrored
+        visible = (clip @ self.clip_planes.T >= 0).all(axis=1)
 
-    bottom_northwest = Vector3(np.array(bottom))
-    bottom_northwest[2] += 2
-    bottom_northwest[0] -= 2
+        # Convert from camera space to screen coordinates
+        screen = clip[visible, :2] / clip[visible, 2:3]
 
-    bottom_northeast = Vector3(np.array(bottom))
-    bottom_northeast[2] += 2
-    bottom_northeast[0] += 2
+        pixels = np.zeros(points.shape[:1] + (2,), dtype=int)
+        pixels[visible] = self.screenToPixels(screen)
+        return pixels, visible
 
-    bottom_southeast = Vector3(np.array(bottom))
-    bottom_southeast[2] -= 2
-    bottom_southeast[0] += 2
+    def screenToPixels(self, screen: np.ndarray) -> np.ndarray:
+        """
+        @param screen (N, 2) array of coordinates after the perspective divide
+        @return (N, 2) array of integer pixel coordinates
+        """
+        normalized = (screen + self.canvas_shape / 2) / self.canvas_shape
+        normalized[:, 1] = 1 - normalized[:, 1]
+        return np.floor(normalized * self.screenShape._np_arr).astype(int)
 
-    bottom_southwest = Vector3(np.array(bottom))
-    bottom_southwest[2] -= 2
-    bottom_southwest[0] -= 2
+    def worldToScreenSegments(self, segments: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Clips line segments to the visible region before projecting them, so
+        segments with an end behind the camera or off screen are shortened
+        rather than dropped.
+        @param segments (N, 2, 3) array of world start and end positions
+        @return (N, 4) array of integer pixel coordinates (x1, y1, x2, y2)
+        and an (N,) mask of the segments with a visible part, pixels of
+        hidden segments are 0
+        """
+        clip = segments @ self.view_projection[:, :3].T + self.view_projection[:, 3]
+        start, end = clip[:, 0], clip[:, 1]
+
+        # Liang-Barsky: narrow each segment's [t0, t1] range plane by plane.
+        # Plane distances are linear along the segment in clip space.
+        start_distance = start @ self.clip_planes.T
+        end_distance = end @ self.clip_planes.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing = start_distance / (start_distance - end_distance)
+        t0 = np.max(np.where(start_distance < 0, crossing, 0), axis=1, initial=0)
+        t1 = np.min(np.where(end_distance < 0, crossing, 1), axis=1, initial=1)
+        outside = ((start_distance < 0) & (end_distance < 0)).any(axis=1)
+        visible = ~outside & (t0 <= t1)
+
+        # Perspective divide only once the ends are known to be in front
+        direction = end[visible] - start[visible]
+        clipped = np.concatenate((
+            start[visible] + direction * t0[visible, np.newaxis],
+            start[visible] + direction * t1[visible, np.newaxis],
+        ))
+        screen = clipped[:, :2] / clipped[:, 2:3]
 
-    top_northwest = Vector3(np.array(top))
-    top_northwest[2] += 2
-    top_northwest[0] -= 2
+        pixels = np.zeros((len(segments), 4), dtype=int)
+        pixels[visible] = self.screenToPixels(screen).reshape(2, -1, 2).transpose(1, 0, 2).reshape(-1, 4)
+        return pixels, visible
 
-    top_northeast = Vector3(np.array(top))
-    top_northeast[2] += 2
-    top_northeast[0] += 2
+    def cameraDepths(self, points: np.ndarray) -> np.ndarray:
+        """
+        @param points (N, 3) array of world positions
+        @return (N,) array of distances in front of the camera
+        """
+        return points @ self.world_to_camera[2, :3] + self.world_to_camera[2, 3]
 
-    top_southeast = Vector3(np.array(top))
-    top_southeast[2] -= 2
-    top_southeast[0] += 2
+    def worldToScreenPoint(self, point: Vector3) -> Vector2:
+        pixels, visible = self.worldToScreenPoints(point._np_arr[np.newaxis])
+        if not visible[0]:
+            return None
+        return Vector2(pixels[0])
 
-    top_southwest = Vector3(np.array(top))
-    top_southwest[2] -= 2
-    top_southwest[0] -= 2
+    def screenToWorldPoint(self, position: Vector2, z: float) -> Vector3:
+        pass
 
-    return (
-        (top_southwest, top_northwest),
-        (top_northwest, top_northeast),
-        (top_northeast, top_southeast),
-        (top_southeast, top_southwest),
 
-        (bottom_southwest, bottom_northwest),
-        (bottom_northwest, bottom_northeast),
-        (bottom_northeast, bottom_southeast),
-        (bottom_southeast, bottom_southwest),
+# Corners of a 4x2x4 box around a point, as (east, up, north) offsets
+BOX_LABELS = ('+SW', '+NW', '+SE', '+NE', '-SW', '-NW', '-SE', '-NE')
+BOX_OFFSETS = np.array((
+    (-2, 2, -2), (-2, 2, 2), (2, 2, -2), (2, 2, 2),
+    (-2, 0, -2), (-2, 0, 2), (2, 0, -2), (2, 0, 2),
+), dtype=float)
+# Pairs of BOX_OFFSETS indices joined by the box's edges
+BOX_EDGES = np.array((
+    (0, 1), (1, 3), (3, 2), (2, 0),
+    (4, 5), (5, 7), (7, 6), (6, 4),
+    (0, 4), (1, 5), (3, 7), (2, 6),
+))
+
+
+def vertices_around(point: Vector3) -> Vector3Array:
+    """
+    @return Corners of the box around point, in the order of BOX_LABELS
+    """
+    return Vector3Array(point._np_arr + BOX_OFFSETS)
+
+
+def wireframe_around(point: Vector3) -> Vector3Array:
+    """
+    @return Start and end points of the box's edges, as consecutive rows
+    """
+    return Vector3Array(point._np_arr + BOX_OFFSETS[BOX_EDGES.ravel()])
+
+
+def paint_overlay(painter: QtGui.QPainter, scene: Scene, rect: QtCore.QRect,
+                  frame: Optional[SceneFrame] = None, region: Optional[QtGui.QRegion] = None) -> None:
+    """
+    Paints the faint background over rect and then the scene's frame, as
+    the overlay window shows them
+    @param region only the part of rect that needs repainting, all of it if None
+    """
+    painter.setOpacity(0.1)
+    painter.setBrush(QtCore.Qt.white)
+    painter.setPen(QtGui.QPen(QtCore.Qt.white))
+    painter.drawRect(rect)
+    scene.paint(painter, frame, region)
+
+
+class FrameWorker(QtCore.QThread):
+    """
+    Reads the link, predicts the pose and projects the scene off the GUI
+    thread. Finished frames are never modified, so handing one over to the
+    GUI is a swap of the front frame under a lock while the next one is
+    built behind it.
+
+    How often it reads and renders is chosen by a FramePacer. While the
+    view is moving it also renders at display rate between link frames, so
+    the predicted pose keeps moving even when frames arrive late or in
+    bursts. While suspended it publishes an empty frame, which hides the
+    overlay.
+
+    The time taken by each stage of a frame is recorded in a FrameStats.
+    """
+    frame_ready = QtCore.pyqtSignal()
+    pacing_changed = QtCore.pyqtSignal(str)
+
+    # Seconds between checks for stop() while waiting for link frames
+    WAKE_INTERVAL = 0.1
+    # Seconds between renders while the view is moving, with or without new
+    # link frames
+    DISPLAY_INTERVAL = 1 / 60
+    # Seconds from rendering a frame until it is on screen (handing it to
+    # the GUI thread and waiting for the next repaint), which the pose is
+    # predicted ahead by
+    DISPLAY_LATENCY = 1 / 60
+
+    def __init__(self, link: MumbleLink, notifier, poll_interval: int, scene: Scene, avatar_box: LabelNode,
+                 screenShape: Vector2, stats: FrameStats):
+        """
+        @param notifier object whose fileno() becomes readable when a new
+        frame is available, or None to poll the link instead
+        @param poll_interval milliseconds between polls when there is no notifier
+        """
+        super().__init__()
+        self.link = link
+        self.notifier = notifier
+        self.poll_interval = poll_interval / 1000
+        self.scene = scene
+        self.avatar_box = avatar_box
+        self.screenShape = screenShape
+        self.stopping = threading.Event()
+        self.pacer = FramePacer()
+        self.stats = stats
+
+        # Recent frames, from which the pose at render time is predicted
+        self.history = LinkHistory(None, capacity=HISTORY_FRAMES)
+        self.predictor = PosePredictor(self.history)
+        self.history.append(link.snapshot, link.timestamp)
+
+        self.lock = threading.Lock()
+        self.front: Optional[SceneFrame] = None
+        self.last_render = 0.0
+        self.map_id: Optional[int] = None
+
+    def stop(self):
+        self.stopping.set()
+        self.wait()
+
+    def latest_frame(self) -> Optional[SceneFrame]:
+        with self.lock:
+            return self.front
+
+    def run(self):
+        self.pace()
+        if not self.pacer.suspended:
+            self.render()
+        while not self.stopping.is_set():
+            changed = self.wait_for_link()
+            if changed:
+                self.history.append(self.link.snapshot, self.link.timestamp)
+            if self.pace():
+                # Show the overlay again straight away when coming back
+                self.render(force=True)
+            elif (changed or self.display_due()) and not self.pacer.suspended:
+                self.render()
+
+    def display_due(self) -> bool:
+        """
+        @return True if the view is moving and a display frame has passed
+        since the last render
+        """
+        return (
+            self.pacer.mode is PacingMode.ACTIVE
+            and time.monotonic() - self.last_render >= self.DISPLAY_INTERVAL
+        )
 
-        (top_southwest, bottom_southwest),
-        (top_northwest, bottom_northwest),
-        (top_northeast, bottom_northeast),
-        (top_southeast, bottom_southeast),
-    )
+    def pace(self) -> bool:
+        """
+        @return True if the overlay was suspended and is shown again
+        """
+        was_suspended = self.pacer.suspended
+        if not self.pacer.observe(self.link.snapshot, time.monotonic()):
+            return False
+        print("Frame pacing:", self.pacer.describe())
+        self.pacing_changed.emit(self.pacer.mode.name)
+        if self.pacer.suspended:
+            self.publish([])
+        return was_suspended
+
+    def wait_for_link(self) -> bool:
+        """
+        @return True if the link has a new frame
+        """
+        # Slower modes read the link less often, on top of waiting for frames
+        if self.stopping.wait(self.pacer.interval()):
+            return False
+        # While moving, give up waiting in time to render the next display frame
+        active = self.pacer.mode is PacingMode.ACTIVE
+        if self.notifier is None:
+            if self.stopping.wait(min(self.poll_interval, self.DISPLAY_INTERVAL) if active else self.poll_interval):
+                return False
+        else:
+            timeout = self.DISPLAY_INTERVAL if active else self.WAKE_INTERVAL
+            readable, _, _ = select.select([self.notifier], [], [], timeout)
+            if not readable:
+                return False
+        try:
+            if self.notifier is not None:
+                self.notifier.drain()
+            with self.stats.stage("link read"):
+                return self.link.update()
+        except ConnectionError as e:
+            print("Lost the link hub, reading the link directly:", e)
+            self.link.close()
+            self.link, self.notifier = open_live_link(use_hub=False)
+            return self.link.update()
+
+    def render(self, force: bool = False):
+        self.last_render = time.monotonic()
+        if self.link.map_id != self.map_id:
+            # Grids of the map left behind are no longer needed
+            self.map_id = self.link.map_id
+            SpatialGrid.drop_other_maps(self.map_id)
+        with self.stats.stage("identity decode"):
+            fov = self.link.identity.fov
+        with self.stats.stage("camera build"):
+            pose = self.predictor.predict(time.time() + self.DISPLAY_LATENCY)
+            camera = Camera.cached(pose.camera_position, pose.camera_front, self.screenShape, fov)
+        self.avatar_box.set_points(vertices_around(pose.avatar_position)._np_arr)
+        if not self.scene.update(camera) and self.front is not None and not force:
+            return
+        self.publish(self.scene.frame())
+
+    def publish(self, frame: SceneFrame):
+        with self.lock:
+            self.front = frame
+        self.frame_ready.emit()
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    # Milliseconds between refreshes of the frame time HUD
+    HUD_INTERVAL = 500
+    HUD_MARGIN = 8
+
+    def __init__(self, notifier=None, poll_interval: int = 50, startup_report: bool = False,
+                 perf_hud: bool = False):
+        """
+        @param notifier object whose fileno() becomes readable when a new
+        frame is available, or None to poll the link instead
+        @param poll_interval milliseconds between polls when there is no notifier
+        @param startup_report print how long startup took once the first
+        frame has been painted
+        @param perf_hud draw frame time percentiles in the top left corner
+        """
         screenShape = QtWidgets.qApp.desktop().availableGeometry()
 
         QMainWindow.__init__(self)
@@ -349,51 +553,140 @@ class MainWindow(QMainWindow):
         self.setAttribute(QtCore.Qt.WA_NoSystemBackground, True)
         self.setAttribute(QtCore.Qt.WA_TranslucentBackground, True)
 
-        self.paint_timer = QtCore.QTimer(self)
-        self.paint_timer.setInterval(50)
-        self.paint_timer.timeout.connect(self.update)
-        self.paint_timer.start()
-
-    def paintEvent(self, event=None):
-        link.update()
-        screenShape = QtWidgets.qApp.desktop().availableGeometry()
-        painter = QtGui.QPainter(self)
+        self.startup_report = startup_report
+        self.painted = False
+        self.stats = FrameStats()
 
-        # Paint rectangle
-        painter.setOpacity(0.1)
-        painter.setBrush(QtCore.Qt.white)
-        painter.setPen(QtGui.QPen(QtCore.Qt.white))
-        painter.drawRect(self.rect())
-
-        # Paint text
-        painter.setFont(QtGui.QFont("Ubuntu Sans", 12, QtGui.QFont.Bold))
-        painter.setOpacity(0.7)
-        painter.setPen(QtGui.QPen(QtCore.Qt.black))
-
-        camera = Camera(
-            Vector3(link.camera_position),
-            Vector3(link.camera_front),
+        # Everything drawn over the game, re-projected only when it or the
+        # camera changes
+        style = dict(
+            pen=QtGui.QPen(QtCore.Qt.black),
+            font=QtGui.QFont("Ubuntu Sans", 12, QtGui.QFont.Bold),
+            opacity=0.7
+        )
+        self.scene = Scene()
+        self.scene.stats = self.stats
+        stairs_position = Vector3(np.array((133.38336181640625, 30.58201789855957, -166.88389587402344)))
+        self.scene.add(LineNode(wireframe_around(stairs_position)._np_arr.reshape(-1, 2, 3), **style))
+        avatar_box = self.scene.add(LabelNode(vertices_around(Vector3.origin())._np_arr, BOX_LABELS, **style))
+        self.scene.add(ScreenLabelNode((0.5, 0.5), "O", **style))
+
+        # The scene belongs to the worker from here on, the GUI thread only
+        # paints the frames it finishes
+        self.worker = FrameWorker(
+            link, notifier, poll_interval, self.scene, avatar_box,
             Vector2(np.array([screenShape.width(), screenShape.height()], dtype=int)),
-            link.identity.fov
+            self.stats
         )
+        # The frame the pending repaints were requested for. Painting always
+        # uses this one, even if the worker has finished a newer one, since
+        # only its changes are covered by the requested region.
+        self.shown_frame: Optional[SceneFrame] = None
+        self.worker.frame_ready.connect(self.on_frame_ready)
+        self.worker.start()
+
+        # Frame time HUD, drawn over the scene and refreshed on a timer
+        self.hud_lines = []
+        self.hud_rect = QtCore.QRect()
+        if perf_hud:
+            self.hud_font = QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont)
+            self.hud_pen = QtGui.QPen(QtCore.Qt.black)
+            self.hud_timer = QtCore.QTimer(self)
+            self.hud_timer.timeout.connect(self.update_hud)
+            self.hud_timer.start(self.HUD_INTERVAL)
+
+    def update_hud(self):
+        self.hud_lines = self.stats.report()
+        metrics = QtGui.QFontMetrics(self.hud_font)
+        width = max(metrics.horizontalAdvance(line) for line in self.hud_lines)
+        rect = QtCore.QRect(
+            self.HUD_MARGIN, self.HUD_MARGIN, width, metrics.lineSpacing() * len(self.hud_lines)
+        ).marginsAdded(QtCore.QMargins(2, 2, 2, 2))
+        self.update(self.hud_rect.united(rect))
+        self.hud_rect = rect
+
+    def on_frame_ready(self):
+        frame = self.worker.latest_frame()
+        previous, self.shown_frame = self.shown_frame, frame
+        # The background covers the whole window, so it appearing or
+        # disappearing needs a full repaint
+        if not previous or not frame:
+            self.update()
+        else:
+            region = damage(previous, frame)
+            if not region.isEmpty():
+                self.update(region)
 
-        stairs_position = Vector3(np.array((133.38336181640625, 30.58201789855957, -166.88389587402344)))
-        for start, stop in wireframe_around(stairs_position):
-            start = camera.worldToScreenPoint(start)
-            stop = camera.worldToScreenPoint(stop)
-            if start and stop:
-                painter.drawLine(QtCore.QPoint(start.x, start.y), QtCore.QPoint(stop.x, stop.y))
+    def paintEvent(self, event=None):
+        # Nothing is drawn at all before the first frame or while suspended
+        frame = self.shown_frame
+        if not frame:
+            return
+        paint_start = time.perf_counter()
+        painter = QtGui.QPainter(self)
+        region = event.region() if event is not None else None
+        if region is not None:
+            painter.setClipRegion(region)
+
+        paint_overlay(painter, self.scene, self.rect(), frame, region)
+        self.stats.record("paint", time.perf_counter() - paint_start)
 
-        for label, point in vertices_around(Vector3(link.avatar_position)).items():
-            point = camera.worldToScreenPoint(point)
-            if point:
-                painter.drawText(QtCore.QPoint(point.x, point.y), label)
+        if self.hud_lines and (region is None or region.intersects(self.hud_rect)):
+            painter.setOpacity(1.0)
+            painter.setFont(self.hud_font)
+            painter.setPen(self.hud_pen)
+            painter.drawText(
+                self.hud_rect.marginsRemoved(QtCore.QMargins(2, 2, 2, 2)), QtCore.Qt.AlignLeft | QtCore.Qt.AlignTop,
+                "\n".join(self.hud_lines)
+            )
 
-        painter.drawText(QtCore.QPoint(int(screenShape.width()/2), int(screenShape.height()/2)), "O")
+        if not self.painted:
+            self.painted = True
+            startup.timer.mark("first paint")
+            startup.timer.print_report(self.startup_report)
 
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    main_window = MainWindow()
-    main_window.show()
+    parser = argparse.ArgumentParser(description="Guild Wars 2 overlay")
+    parser.add_argument("--replay", metavar="PATH", help="play back a link recording instead of the live game")
+    parser.add_argument("--max-speed", action="store_true", help="replay one frame per repaint instead of in real time")
+    parser.add_argument("--loop", action="store_true", help="restart the replay when it ends")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print how long each startup stage took (or set {})".format(startup.REPORT_ENV))
+    parser.add_argument("--perf-hud", action="store_true", help="show frame time percentiles per stage on screen")
+    parser.add_argument("--perf-export", metavar="PATH",
+                        help="write frame time percentiles per stage to PATH on exit, as CSV if it ends in .csv "
+                             "and JSON otherwise")
+    args, qt_args = parser.parse_known_args()
+
+    with startup.timer.stage("open link"):
+        if args.replay:
+            link = MumbleLink(LinkReplay(args.replay, realtime=not args.max_speed, loop=args.loop))
+            notifier = None
+            poll_interval = 0 if args.max_speed else 5
+        else:
+            link, notifier = open_live_link()
+            poll_interval = 50
+    with startup.timer.stage("create api"):
+        api = GW2API()
+    print(link)
+
+    with startup.timer.stage("create application"):
+        app = QApplication(sys.argv[:1] + qt_args)
+    with startup.timer.stage("create window"):
+        main_window = MainWindow(notifier, poll_interval, args.startup_report, args.perf_hud)
+        main_window.show()
+    app.aboutToQuit.connect(main_window.worker.stop)
+    if args.perf_export:
+        app.aboutToQuit.connect(lambda: main_window.stats.export(args.perf_export))
+
+    # The window can't be closed, so Ctrl+C and SIGTERM are how the overlay
+    # is stopped. Quitting the event loop rather than dying lets the worker
+    # stop and the exports be written. Python only runs the handlers once
+    # Qt calls back into it, hence the timer doing nothing.
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: app.quit())
+    signal_timer = QtCore.QTimer()
+    signal_timer.timeout.connect(lambda: None)
+    signal_timer.start(SIGNAL_CHECK_INTERVAL)
     app.exec_()
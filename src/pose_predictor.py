@@ -0,0 +1,77 @@
+"""
+Estimates where the camera and avatar are at an arbitrary time from the
+timestamped frames in a LinkHistory, so the overlay can be drawn for the
+moment it is painted rather than for the moment the last frame was read.
+"""
+import numpy as np
+from typing import NamedTuple, Optional
+
+from geometry import Vector3
+from link_history import LinkHistory
+
+
+# Never predict further ahead of the latest frame than this many seconds
+MAX_EXTRAPOLATION = 0.1
+# Frames further apart than this are a teleport or a pause, not movement
+MAX_FRAME_GAP = 0.25
+HISTORY_FRAMES = 8
+
+
+class Pose(NamedTuple):
+    camera_position: Vector3
+    camera_front: Vector3
+    avatar_position: Vector3
+
+
+class PosePredictor:
+    def __init__(self, history: LinkHistory, max_extrapolation: float = MAX_EXTRAPOLATION):
+        self.history = history
+        self.max_extrapolation = max_extrapolation
+
+    def predict(self, at_time: float) -> Optional[Pose]:
+        """
+        @param at_time time.time() to estimate the pose at
+        @return Pose interpolated between the frames around at_time, or
+        extrapolated from the last two frames (by at most max_extrapolation),
+        or None if the history is empty
+        """
+        frames = self.history.recent(HISTORY_FRAMES)
+        if not len(frames):
+            return None
+        # Only interpolate within the current map
+        frames = frames[frames['map_id'] == frames['map_id'][-1]]
+        timestamps = frames['timestamp']
+
+        if len(frames) == 1 or at_time <= timestamps[0]:
+            return self.pose(frames[-1] if len(frames) == 1 else frames[0])
+
+        index = int(np.searchsorted(timestamps, at_time, side='right'))
+        if index < len(frames):
+            before, after = frames[index - 1], frames[index]
+            elapsed = at_time - before['timestamp']
+        else:
+            before, after = frames[-2], frames[-1]
+            elapsed = (after['timestamp'] - before['timestamp']) + min(at_time - after['timestamp'], self.max_extrapolation)
+
+        duration = after['timestamp'] - before['timestamp']
+        if duration <= 0 or duration > MAX_FRAME_GAP:
+            return self.pose(after if index >= len(frames) else before)
+        return self.interpolate(before, after, elapsed / duration)
+
+    @staticmethod
+    def pose(frame: np.void) -> Pose:
+        return Pose(
+            Vector3(frame['camera_position'].astype(float)),
+            Vector3(frame['camera_front'].astype(float)),
+            Vector3(frame['avatar_position'].astype(float))
+        )
+
+    @classmethod
+    def interpolate(cls, before: np.void, after: np.void, t: float) -> Pose:
+        start = cls.pose(before)
+        stop = cls.pose(after)
+        return Pose(
+            start.camera_position.lerp(stop.camera_position, t),
+            start.camera_front.slerp(stop.camera_front, t),
+            start.avatar_position.lerp(stop.avatar_position, t)
+        )
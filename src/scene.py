@@ -0,0 +1,489 @@
+"""
+A retained scene for the overlay. Drawable nodes keep the screen space
+primitives they were last projected to, and are only projected again when
+the camera changes or the node itself is changed. Painting replays the
+cached primitives.
+
+The primitives of a node are replaced rather than modified when it is
+projected again, so a SceneFrame taken after an update stays valid while
+the next one is being prepared, possibly on another thread. Primitives that
+come out of a projection unchanged are kept as the same object, so that
+damage() only has to compare identities to find what needs repainting.
+
+Cameras are compared by identity: Camera.cached() returns the same object
+for as long as the view is unchanged.
+
+Nodes drawing many points that stay put (the markers of a map) can be given
+the map's id, so only the points in grid cells near the view are projected.
+"""
+import time
+import numpy as np
+from typing import Any, List, Optional, Sequence, Tuple
+
+from PyQt5 import QtGui, QtCore
+
+from geometry import SpatialGrid
+from draw_arrays import (
+    PointPairs, PixmapFragments, FRAGMENT_FIELDS, point_pairs, pairs_bounds, fragment_batches, batches_bounds,
+    polygon, same_contents, draw_lines, draw_points, draw_fragment_batches
+)
+from label_cache import TextAtlas
+
+
+# Extra pixels around the computed bounds of primitives, for antialiasing
+# and text that overhangs its metrics
+DAMAGE_MARGIN = 2
+# Pixel size of atlas icons at the reference distance in world units, they
+# shrink further away down to the minimum size and grow closer up to the
+# largest atlas level
+ICON_SIZE = 48
+ICON_REFERENCE_DISTANCE = 20.0
+MIN_ICON_SIZE = 8
+
+
+class Node:
+    def __init__(self, pen: Optional[QtGui.QPen] = None, font: Optional[QtGui.QFont] = None, opacity: float = 1.0):
+        """
+        Pens and fonts are built once by whoever creates the node, instead of
+        on every paint
+        """
+        self.pen = pen
+        self.font = font
+        self.opacity = opacity
+        self.visible = True
+        self.dirty = True
+        self.primitives: Any = None
+        self.bounds = QtCore.QRect()
+        # Grid the node's points are culled with, see index_points()
+        self.map_id: Optional[int] = None
+        self.grid: Optional[SpatialGrid] = None
+        # Seconds the last projection spent culling with the grid
+        self.culling_time = 0.0
+
+    def set_points(self, points: np.ndarray) -> None:
+        """
+        Replaces the node's world positions, only marking it dirty if they
+        actually changed
+        """
+        if not np.array_equal(points, self.points):
+            self.points = points
+            self.dirty = True
+            if self.map_id is not None:
+                self.grid = SpatialGrid.cached(self.map_id, points)
+
+    def index_points(self, map_id: Optional[int]) -> None:
+        """
+        Culls the node's points with the SpatialGrid of map_id from now on,
+        shared with other nodes of the same points, or projects every point
+        if None. Only worth it for points that rarely change.
+        """
+        self.map_id = map_id
+        self.grid = SpatialGrid.cached(map_id, self.points) if map_id is not None else None
+
+    def visible_points(self, camera) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        @return Indices of the node's points that are on screen, in order,
+        and their pixel coordinates
+        """
+        if self.grid is None:
+            candidates = np.arange(len(self.points))
+        else:
+            start = time.perf_counter()
+            candidates = np.sort(self.grid.query_frustum(camera.frustum_planes))
+            self.culling_time = time.perf_counter() - start
+        pixels, visible = camera.worldToScreenPoints(self.points[candidates])
+        return candidates[visible], pixels[visible]
+
+    def needs_projection(self, camera, camera_changed: bool) -> bool:
+        return self.dirty or camera_changed
+
+    def project(self, camera) -> Any:
+        """
+        @return The screen space primitives of the node for this camera
+        """
+        raise NotImplementedError
+
+    def keep_atlas_pages(self) -> None:
+        """
+        Marks the atlas pages the node's primitives draw from as used, for
+        nodes drawing from an atlas
+        """
+
+    def bounds_of(self, primitives: Any) -> QtCore.QRect:
+        """
+        @return Screen area the primitives are drawn within, not counting
+        the margin for the pen
+        """
+        raise NotImplementedError
+
+    def margin(self) -> int:
+        return DAMAGE_MARGIN + (int(self.pen.widthF() + 1) // 2 if self.pen is not None else 0)
+
+    def text_atlas(self) -> TextAtlas:
+        """
+        @return The atlas of text rendered in the node's font and pen color
+        """
+        font = self.font if self.font is not None else QtGui.QFont()
+        color = self.pen.color() if self.pen is not None else QtGui.QColor(QtCore.Qt.black)
+        return TextAtlas.shared(font, color)
+
+    def paint(self, painter: QtGui.QPainter, primitives: Any) -> None:
+        if self.pen is not None:
+            painter.setPen(self.pen)
+        if self.font is not None:
+            painter.setFont(self.font)
+        painter.setOpacity(self.opacity)
+        self.draw(painter, primitives)
+
+    def draw(self, painter: QtGui.QPainter, primitives: Any) -> None:
+        raise NotImplementedError
+
+
+class LineNode(Node):
+    def __init__(self, segments: np.ndarray, **style):
+        """
+        @param segments (N, 2, 3) array of world start and end positions
+        """
+        super().__init__(**style)
+        self.points = segments
+
+    def segments(self) -> np.ndarray:
+        return self.points
+
+    def project(self, camera) -> PointPairs:
+        pixels, visible = camera.worldToScreenSegments(self.segments())
+        return point_pairs(pixels[visible])
+
+    def bounds_of(self, pairs: PointPairs) -> QtCore.QRect:
+        return pairs_bounds(pairs)
+
+    def draw(self, painter: QtGui.QPainter, pairs: PointPairs) -> None:
+        draw_lines(painter, pairs)
+
+
+class TrailNode(LineNode):
+    """
+    A path through world positions, such as where the player has walked
+    """
+
+    def __init__(self, points: Optional[np.ndarray] = None, max_points: int = 1024, **style):
+        super().__init__(np.zeros((0, 3)) if points is None else points, **style)
+        self.max_points = max_points
+
+    def segments(self) -> np.ndarray:
+        return np.stack((self.points[:-1], self.points[1:]), axis=1)
+
+    def append(self, point: np.ndarray) -> None:
+        self.points = np.concatenate((self.points, point[np.newaxis]))[-self.max_points:]
+        self.dirty = True
+
+
+class PointNode(Node):
+    def __init__(self, points: np.ndarray, map_id: Optional[int] = None, **style):
+        """
+        @param points (N, 3) array of world positions, each drawn as a dot in
+        the pen's width
+        @param map_id map the points belong to, see Node.index_points()
+        """
+        super().__init__(**style)
+        self.points = points
+        self.index_points(map_id)
+
+    def project(self, camera) -> QtGui.QPolygonF:
+        _, pixels = self.visible_points(camera)
+        return polygon(pixels)
+
+    def bounds_of(self, points: QtGui.QPolygonF) -> QtCore.QRect:
+        return points.boundingRect().toAlignedRect() if points.size() else QtCore.QRect()
+
+    def draw(self, painter: QtGui.QPainter, points: QtGui.QPolygonF) -> None:
+        draw_points(painter, points)
+
+
+class LabelNode(Node):
+    def __init__(self, points: np.ndarray, labels: Sequence[str], map_id: Optional[int] = None, **style):
+        """
+        @param points (N, 3) array of world positions, one per label
+        @param map_id map the points belong to, see Node.index_points()
+        """
+        super().__init__(**style)
+        self.points = points
+        self.labels = labels
+        self.index_points(map_id)
+
+    def project(self, camera) -> List[Tuple[int, PixmapFragments]]:
+        indices, pixels = self.visible_points(camera)
+        labels = [self.labels[index] for index in indices.tolist()]
+        return self.text_atlas().label_fragments(pixels, labels)
+
+    def bounds_of(self, batches: List[Tuple[int, PixmapFragments]]) -> QtCore.QRect:
+        return batches_bounds(batches)
+
+    def keep_atlas_pages(self) -> None:
+        self.text_atlas().keep_pages(page for page, _ in self.primitives)
+
+    def draw(self, painter: QtGui.QPainter, batches: List[Tuple[int, PixmapFragments]]) -> None:
+        draw_fragment_batches(painter, batches, self.text_atlas().pixmap)
+
+
+class DistanceLabelNode(Node):
+    """
+    The distance from the camera to each point, written below it. Drawn a
+    character at a time since the text changes whenever the camera moves.
+    """
+
+    def __init__(self, points: np.ndarray, label_format: str = "{:.0f}m",
+                 offset: Tuple[int, int] = (0, 16), map_id: Optional[int] = None, **style):
+        """
+        @param label_format format of the distance in world units
+        @param offset pixels from each point to the start of its label
+        @param map_id map the points belong to, see Node.index_points()
+        """
+        super().__init__(**style)
+        self.points = points
+        self.label_format = label_format
+        self.offset = np.array(offset)
+        self.index_points(map_id)
+
+    def project(self, camera) -> List[Tuple[int, PixmapFragments]]:
+        indices, pixels = self.visible_points(camera)
+        distances = np.linalg.norm(self.points[indices] - camera.location._np_arr, axis=1)
+        labels = [self.label_format.format(distance) for distance in distances.tolist()]
+        return self.text_atlas().glyph_fragments(pixels + self.offset, labels)
+
+    def bounds_of(self, batches: List[Tuple[int, PixmapFragments]]) -> QtCore.QRect:
+        return batches_bounds(batches)
+
+    def keep_atlas_pages(self) -> None:
+        self.text_atlas().keep_pages(page for page, _ in self.primitives)
+
+    def draw(self, painter: QtGui.QPainter, batches: List[Tuple[int, PixmapFragments]]) -> None:
+        draw_fragment_batches(painter, batches, self.text_atlas().pixmap)
+
+
+class IconNode(Node):
+    def __init__(self, points: np.ndarray, pixmap: QtGui.QPixmap, map_id: Optional[int] = None, **style):
+        """
+        @param points (N, 3) array of world positions, each drawn with the
+        pixmap centered on it
+        @param map_id map the points belong to, see Node.index_points()
+        """
+        super().__init__(**style)
+        self.points = points
+        self.pixmap = pixmap
+        self.index_points(map_id)
+
+    def project(self, camera) -> List[QtCore.QPoint]:
+        _, pixels = self.visible_points(camera)
+        half_size = np.array([self.pixmap.width() // 2, self.pixmap.height() // 2])
+        return [QtCore.QPoint(x, y) for x, y in (pixels - half_size).tolist()]
+
+    def bounds_of(self, corners: List[QtCore.QPoint]) -> QtCore.QRect:
+        bounds = QtCore.QRect()
+        for corner in corners:
+            bounds = bounds.united(QtCore.QRect(corner, self.pixmap.size()))
+        return bounds
+
+    def draw(self, painter: QtGui.QPainter, corners: List[QtCore.QPoint]) -> None:
+        for corner in corners:
+            painter.drawPixmap(corner, self.pixmap)
+
+
+class AtlasIconNode(Node):
+    """
+    Icons scaled by their distance from the camera, drawn from an IconAtlas
+    with one drawPixmapFragments call per atlas page
+    """
+
+    def __init__(self, points: np.ndarray, icons: Sequence[str], atlas, size: float = ICON_SIZE,
+                 reference_distance: float = ICON_REFERENCE_DISTANCE, map_id: Optional[int] = None, **style):
+        """
+        @param points (N, 3) array of world positions
+        @param icons image path of each point's icon
+        @param atlas IconAtlas shared between nodes
+        @param map_id map the points belong to, see Node.index_points()
+        """
+        super().__init__(**style)
+        self.points = points
+        self.atlas = atlas
+        self.size = size
+        self.reference_distance = reference_distance
+        self.paths, self.icon_ids = np.unique(np.asarray(icons), return_inverse=True)
+        self.icon_ids = self.icon_ids.reshape(-1)
+        self.index_points(map_id)
+
+    def project(self, camera) -> List[Tuple[int, PixmapFragments]]:
+        indices, pixels = self.visible_points(camera)
+        depths = camera.cameraDepths(self.points[indices])
+        sizes = np.clip(
+            self.size * self.reference_distance / np.maximum(depths, 1e-6), MIN_ICON_SIZE, self.atlas.levels[0]
+        )
+
+        # Look each icon up once per level it is drawn at, not once per marker
+        levels = np.array(sorted(self.atlas.levels))
+        level_indices = np.minimum(np.searchsorted(levels, sizes), len(levels) - 1)
+        keys, inverse = np.unique(self.icon_ids[indices] * len(levels) + level_indices, return_inverse=True)
+        # Columns are the page, source rectangle and level of each key
+        entries = np.full((len(keys), 6), -1.0)
+        for row, key in enumerate(keys.tolist()):
+            entry = self.atlas.lookup(str(self.paths[key // len(levels)]), levels[key % len(levels)])
+            if entry is not None:
+                entries[row] = entry
+        entries = entries[inverse.reshape(-1)]
+        loaded = entries[:, 0] >= 0
+
+        fragments = np.zeros((int(loaded.sum()), len(FRAGMENT_FIELDS)))
+        fragments[:, 0:2] = pixels[loaded]
+        fragments[:, 2:6] = entries[loaded, 1:5]
+        # Scale by the longer side, like the atlas levels were
+        scale = sizes[loaded] / entries[loaded, 5]
+        fragments[:, 6] = scale
+        fragments[:, 7] = scale
+        fragments[:, 9] = 1
+        return fragment_batches(entries[loaded, 0].astype(int), fragments)
+
+    def bounds_of(self, batches: List[Tuple[int, PixmapFragments]]) -> QtCore.QRect:
+        return batches_bounds(batches)
+
+    def keep_atlas_pages(self) -> None:
+        self.atlas.keep_pages(page for page, _ in self.primitives)
+
+    def draw(self, painter: QtGui.QPainter, batches: List[Tuple[int, PixmapFragments]]) -> None:
+        draw_fragment_batches(painter, batches, self.atlas.pixmap)
+
+
+class ScreenLabelNode(Node):
+    """
+    Text at a fixed place on the screen, which only moves if the screen is
+    resized
+    """
+
+    def __init__(self, anchor: Tuple[float, float], label: str, **style):
+        """
+        @param anchor position as fractions of the screen width and height
+        """
+        super().__init__(**style)
+        self.anchor = anchor
+        self.label = label
+        self.screen_shape: Optional[np.ndarray] = None
+
+    def needs_projection(self, camera, camera_changed: bool) -> bool:
+        # Only the screen's size matters, not where the camera is
+        return self.dirty or not np.array_equal(camera.screenShape._np_arr, self.screen_shape)
+
+    def project(self, camera) -> List[Tuple[int, PixmapFragments]]:
+        self.screen_shape = camera.screenShape._np_arr.copy()
+        width, height = self.screen_shape.tolist()
+        position = np.array([[int(width * self.anchor[0]), int(height * self.anchor[1])]])
+        return self.text_atlas().label_fragments(position, [self.label])
+
+    def bounds_of(self, batches: List[Tuple[int, PixmapFragments]]) -> QtCore.QRect:
+        return batches_bounds(batches)
+
+    def keep_atlas_pages(self) -> None:
+        self.text_atlas().keep_pages(page for page, _ in self.primitives)
+
+    def draw(self, painter: QtGui.QPainter, batches: List[Tuple[int, PixmapFragments]]) -> None:
+        draw_fragment_batches(painter, batches, self.text_atlas().pixmap)
+
+
+# The primitives and bounds of every visible node at one point in time, in
+# paint order
+SceneFrame = List[Tuple[Node, Any, QtCore.QRect]]
+
+
+def damage(previous: SceneFrame, current: SceneFrame) -> QtGui.QRegion:
+    """
+    @return Screen area that changed between two frames of the same scene:
+    where nodes with new primitives were and now are, and where removed or
+    hidden nodes were
+    """
+    before = {node: (primitives, bounds) for node, primitives, bounds in previous}
+    region = QtGui.QRegion()
+    for node, primitives, bounds in current:
+        old_primitives, old_bounds = before.pop(node, (None, None))
+        if old_primitives is primitives:
+            continue
+        region += bounds
+        if old_bounds is not None:
+            region += old_bounds
+    for _, bounds in before.values():
+        region += bounds
+    return region
+
+
+class Scene:
+    def __init__(self):
+        self.nodes: List[Node] = []
+        self.camera = None
+        # FrameStats to record culling, projection and bounds times in, if any
+        self.stats = None
+
+    def add(self, node: Node) -> Node:
+        self.nodes.append(node)
+        return node
+
+    def remove(self, node: Node) -> None:
+        self.nodes.remove(node)
+
+    def update(self, camera) -> int:
+        """
+        Projects the nodes that changed, and if the camera changed, every
+        node that depends on it
+        @return Number of nodes projected
+        """
+        camera_changed = camera is not self.camera
+        self.camera = camera
+        projected = 0
+        # Primitives that aren't projected again (and those the GUI is still
+        # showing) keep drawing from their atlas pages, which this update's
+        # lookups must therefore not evict and refill
+        for node in self.nodes:
+            if node.primitives is not None:
+                node.keep_atlas_pages()
+        # Culling with the grid and projection, versus finding where the
+        # results are on screen and whether they changed
+        culling_time = projection_time = bounds_time = 0.0
+        culled = False
+        for node in self.nodes:
+            if node.needs_projection(camera, camera_changed):
+                node.culling_time = 0.0
+                start = time.perf_counter()
+                primitives = node.project(camera)
+                projected_time = time.perf_counter()
+                bounds = node.bounds_of(primitives)
+                if bounds.isValid():
+                    bounds = bounds.marginsAdded(QtCore.QMargins(*[node.margin()] * 4))
+                if bounds != node.bounds or not same_contents(primitives, node.primitives):
+                    node.primitives = primitives
+                    node.bounds = bounds
+                node.dirty = False
+                projected += 1
+                culled |= node.grid is not None
+                culling_time += node.culling_time
+                projection_time += projected_time - start - node.culling_time
+                bounds_time += time.perf_counter() - projected_time
+        if self.stats is not None and projected:
+            if culled:
+                self.stats.record("culling", culling_time)
+            self.stats.record("projection", projection_time)
+            self.stats.record("bounds", bounds_time)
+        return projected
+
+    def frame(self) -> SceneFrame:
+        return [
+            (node, node.primitives, node.bounds)
+            for node in self.nodes if node.visible and node.primitives is not None
+        ]
+
+    def paint(self, painter: QtGui.QPainter, frame: Optional[SceneFrame] = None,
+              region: Optional[QtGui.QRegion] = None) -> None:
+        """
+        @param frame primitives taken with frame(), or None for the current ones
+        @param region only paint the nodes within this area, or everything
+        """
+        if frame is None:
+            frame = self.frame()
+        for node, primitives, bounds in frame:
+            if region is None or region.intersects(bounds):
+                node.paint(painter, primitives)
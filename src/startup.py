@@ -0,0 +1,57 @@
+"""
+Times the stages of starting a tool (imports, opening the link, creating the
+window...) so regressions in cold start time are easy to spot. Only uses the
+standard library so it can be imported before anything heavy.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+
+# Set to print the startup report without passing --startup-report
+REPORT_ENV = "FLAN_STARTUP_REPORT"
+
+
+class StartupTimer:
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+        self.reported = False
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - start))
+
+    def mark(self, name: str) -> None:
+        """
+        Records a stage lasting from the end of the previous one until now
+        """
+        previous_end = self.start_time + sum(duration for _, duration in self.stages)
+        self.stages.append((name, time.perf_counter() - previous_end))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start_time
+
+    def report(self) -> str:
+        lines = ["{:8.1f} ms  {}".format(duration * 1000, name) for name, duration in self.stages]
+        lines.append("{:8.1f} ms  total".format(self.elapsed() * 1000))
+        return "\n".join(lines)
+
+    def print_report(self, force: bool = False) -> None:
+        """
+        Prints the report once, if forced or if the environment asks for it
+        """
+        if self.reported or not (force or os.environ.get(REPORT_ENV)):
+            return
+        self.reported = True
+        print("Startup time:")
+        print(self.report())
+
+
+# Started as early as possible by whichever module imports this first
+timer = StartupTimer()